@@ -30,9 +30,11 @@ print(f"✓ API Key found (first 10 chars): {api_key[:10]}...")
 
 # Now import everything else
 from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from routes.api import api_blueprint
 from utils.config import Config
+from utils.tracing import tracer
 import logging
 
 # Configure logging
@@ -47,12 +49,23 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class TracedJSONProvider(DefaultJSONProvider):
+    """JSON provider that records response serialization as a trace span"""
+    
+    def dumps(self, obj, **kwargs):
+        with tracer.span('response.serialize') as span:
+            body = super().dumps(obj, **kwargs)
+            span.set_attribute('bytes', len(body))
+            return body
+
+
 def create_app(config_class=Config):
     """
     Application factory pattern for Flask
     Creates and configures the Flask application
     """
     app = Flask(__name__)
+    app.json = TracedJSONProvider(app)
     app.config.from_object(config_class)
     
     # Log application startup
@@ -66,7 +79,8 @@ def create_app(config_class=Config):
         r"/api/*": {
             "origins": [frontend_url, "http://localhost:3000"],
             "methods": ["GET", "POST", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "traceparent"],
+            "expose_headers": ["traceparent"],
             "supports_credentials": True
         }
     })
@@ -90,7 +104,10 @@ def create_app(config_class=Config):
                 'chat': '/api/chat',
                 'explain': '/api/explain',
                 'improve': '/api/improve',
-                'models': '/api/models'
+                'models': '/api/models',
+                'admission': '/api/admission',
+                'upstream': '/api/upstream',
+                'budget': '/api/budget'
             }
         }), 200
     
@@ -115,6 +132,10 @@ def create_app(config_class=Config):
     def rate_limit_exceeded(error):
         return jsonify({'success': False, 'error': 'Rate limit exceeded'}), 429
     
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({'success': False, 'error': 'Service temporarily unavailable'}), 503
+    
     @app.errorhandler(500)
     def internal_error(error):
         logger.error(f"Internal server error: {error}", exc_info=True)
@@ -127,6 +148,10 @@ if __name__ == '__main__':
     # Create app instance
     app = create_app()
     
+    # Warm upstream connections before the first request
+    from routes.api import gemini_service
+    gemini_service.transport.start()
+    
     # Get configuration
     port = int(os.getenv('PORT', 5000))
     host = '0.0.0.0'
@@ -0,0 +1,129 @@
+"""
+Capacity benchmark and serving recommendation
+
+Drives the real Flask app in-process with a stand-in for the upstream model
+call (a sleep of --simulated-latency seconds), to measure:
+
+  * CPU milliseconds the app itself spends per request
+  * resident memory of one loaded worker
+  * throughput and latency as the thread count grows
+
+and then prints the gunicorn profile recommended for the given container
+size, using the measured costs.
+
+Usage:
+    python benchmarks/bench_capacity.py --cpus 2 --memory-mb 1024 [--upstream-latency 8]
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark-key')
+os.environ.setdefault('ARTIFACT_DB_PATH', os.path.join(tempfile.mkdtemp(), 'artifacts.db'))
+os.environ.setdefault('ADMISSION_ENABLED', 'false')
+
+from utils.serving import available_cpus, available_memory_mb, recommend
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cpus', type=float, default=None, help='Target container CPUs (default: this machine)')
+    parser.add_argument('--memory-mb', type=float, default=None, help='Target container memory limit')
+    parser.add_argument('--upstream-latency', type=float, default=8.0, help='Expected production model latency (s)')
+    parser.add_argument('--simulated-latency', type=float, default=0.2, help='Stand-in upstream latency used here (s)')
+    parser.add_argument('--requests', type=int, default=400)
+    args = parser.parse_args()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    import app as application
+    from routes import api
+
+    flask_app = application.create_app()
+    worker_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    latency = {'seconds': 0.0}
+    code = 'def add(a, b):\n    return a + b\n' * 20
+
+    def stand_in_upstream(prompt, **generation_config):
+        time.sleep(latency['seconds'])
+        return code
+
+    api.gemini_service._generate_content = stand_in_upstream
+    client = flask_app.test_client()
+    counter = iter(range(10 ** 9))
+
+    def one_request():
+        # Unique client address per request so the per-IP rate limiter stays out of the way
+        n = next(counter)
+        start = time.perf_counter()
+        response = client.post(
+            '/api/generate',
+            json={'prompt': f'Write an add function, variant {n}', 'language': 'python'},
+            environ_base={'REMOTE_ADDR': f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'}
+        )
+        assert response.status_code == 200, response.get_json()
+        return time.perf_counter() - start
+
+    # 1. CPU cost per request with zero upstream latency
+    for _ in range(20):
+        one_request()
+    cpu_start = time.process_time()
+    for _ in range(args.requests):
+        one_request()
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / args.requests
+
+    print(f"App CPU per request:   {cpu_ms:.2f} ms")
+    print(f"Worker RSS after load: {worker_rss_mb:.0f} MB (interpreter baseline {rss_before / 1024:.0f} MB)")
+
+    # 2. Throughput vs threads with simulated upstream latency
+    latency['seconds'] = args.simulated_latency
+    print(f"\nSimulated upstream latency {args.simulated_latency:.2f}s, one process:")
+    print(f"{'threads':>8} {'req/s':>8} {'ideal':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for threads in (1, 4, 8, 16, 32, 64):
+        total = max(threads * 4, 20)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            timings = list(pool.map(lambda _: one_request(), range(total)))
+        elapsed = time.perf_counter() - start
+        ideal = threads / args.simulated_latency
+        print(f"{threads:>8} {total / elapsed:>8.1f} {ideal:>8.1f} "
+              f"{percentile(timings, 0.5) * 1000:>8.0f} {percentile(timings, 0.95) * 1000:>8.0f}")
+
+    # 3. Recommendation for the target container
+    cpus = args.cpus or available_cpus()
+    memory_mb = args.memory_mb or available_memory_mb()
+    profile = recommend(
+        cpus=cpus,
+        memory_mb=memory_mb,
+        upstream_latency=args.upstream_latency,
+        cpu_ms_per_request=cpu_ms,
+        worker_memory_mb=worker_rss_mb
+    )
+
+    print(f"\nRecommended for {cpus:g} CPU / {memory_mb or 'unlimited'} MB, "
+          f"{args.upstream_latency:g}s upstream latency:")
+    print(f"  WEB_CONCURRENCY={profile['workers']}")
+    print(f"  GUNICORN_THREADS={profile['threads']}"
+          f"{'  (capped; the latency/CPU ratio asks for more)' if profile['threads_capped'] else ''}")
+    print(f"  CPU_MS_PER_REQUEST={cpu_ms:.0f}")
+    print(f"  ADMISSION_MAX_IN_FLIGHT={profile['admission_max_in_flight']}")
+    print(f"  ADMISSION_MAX_QUEUE={profile['admission_max_queue']}")
+    print(f"  -> up to {profile['max_concurrent_requests']} concurrent requests, "
+          f"~{profile['expected_max_rps']} req/s")
+
+
+if __name__ == '__main__':
+    main()
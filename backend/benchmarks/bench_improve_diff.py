@@ -0,0 +1,203 @@
+"""
+Benchmark full-rewrite vs diff output for /api/improve on real model responses
+
+Two steps:
+
+  record  Calls the model (GEMINI_API_KEY) in both modes for each file of a
+          corpus and appends the raw responses, wall-clock latency and
+          output token counts to a JSON-lines recording.
+  report  Replays a recording offline: applies every diff-mode response
+          exactly as GeminiService does and reports how often it applies,
+          output tokens and latency per mode, and the effective cost of
+          diff mode once failed diffs fall back to a full rewrite.
+
+Usage:
+    python benchmarks/bench_improve_diff.py record [--corpus DIR] [--max-files 20]
+    python benchmarks/bench_improve_diff.py report [--recording FILE]
+"""
+import argparse
+import ast
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from services.gemini_service import GeminiService
+from utils.helpers import estimate_tokens
+from utils.output_budget import OutputBudgetPlanner
+from utils.patching import PatchError
+
+DEFAULT_RECORDING = BASE_DIR / 'data' / 'improve_recordings.jsonl'
+FOCUS_TEXT = 'Provide overall improvements across all aspects'
+
+
+class RecordingPlanner(OutputBudgetPlanner):
+    """Budget planner that also remembers the real output tokens of each call"""
+
+    def __init__(self):
+        super().__init__()
+        self.output_tokens = 0
+
+    def record(self, kind, language, input_tokens, budget, actual, truncated):
+        self.output_tokens += actual
+        super().record(kind, language, input_tokens, budget, actual, truncated)
+
+
+def record(args) -> None:
+    service = GeminiService()
+    planner = RecordingPlanner()
+    service.budget_planner = planner
+
+    responses = []
+    generate_content = service._generate_content
+
+    def capture(prompt, **kwargs):
+        text = generate_content(prompt, **kwargs)
+        responses.append(text)
+        return text
+    service._generate_content = capture
+
+    files = sorted(
+        path for path in Path(args.corpus).rglob(args.pattern)
+        if 'benchmarks' not in path.parts and 0 < path.stat().st_size <= args.max_chars
+    )[:args.max_files]
+
+    Path(args.recording).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.recording, 'a') as out:
+        for path in files:
+            code = path.read_text()
+            for mode in ('diff', 'full'):
+                responses.clear()
+                planner.output_tokens = 0
+                start = time.perf_counter()
+                try:
+                    if mode == 'diff':
+                        # Generate only; applying (and fallback) is scored by report
+                        try:
+                            service._improve_code_diff(code, args.language, FOCUS_TEXT)
+                        except PatchError:
+                            pass
+                    else:
+                        service.improve_code(code, args.language, 'general', mode='full')
+                except Exception as e:
+                    print(f"{path.name}: {mode} failed: {e}")
+                    continue
+                latency = time.perf_counter() - start
+
+                out.write(json.dumps({
+                    'file': str(path.relative_to(args.corpus)),
+                    'language': args.language,
+                    'mode': mode,
+                    'model': service.model_name,
+                    'code': code,
+                    'response': responses[-1] if responses else '',
+                    'latency_s': round(latency, 3),
+                    'output_tokens': planner.output_tokens,
+                    'recorded_at': time.time()
+                }) + '\n')
+                out.flush()
+                print(f"{path.name:<40} {mode:<5} {latency:6.1f}s {planner.output_tokens:>6} tok")
+
+
+def valid_python(code: str) -> bool:
+    try:
+        ast.parse(code)
+        return True
+    except SyntaxError:
+        return False
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def report(args) -> None:
+    if not os.path.exists(args.recording):
+        print(f"No recording at {args.recording}; run the 'record' step first")
+        return
+
+    runs = {}
+    with open(args.recording) as recording:
+        for line in recording:
+            entry = json.loads(line)
+            runs.setdefault((entry['file'], entry['code']), {})[entry['mode']] = entry
+    pairs = [modes for modes in runs.values() if 'diff' in modes and 'full' in modes]
+    if not pairs:
+        print("Recording has no file with both a diff and a full response")
+        return
+
+    print(f"{'file':<32} {'full tok':>8} {'diff tok':>8} {'full s':>7} {'diff s':>7} {'applied':>8}")
+    print('-' * 76)
+
+    applied = invalid = 0
+    full_tokens, diff_tokens, effective_tokens = [], [], []
+    full_latency, diff_latency, effective_latency = [], [], []
+    apply_ms = []
+
+    for modes in pairs:
+        full, diff = modes['full'], modes['diff']
+        start = time.perf_counter()
+        try:
+            result = GeminiService.apply_diff_response(diff['code'], diff['response'])
+            ok = True
+            if diff['file'].endswith('.py') and not valid_python(result['improved_code']):
+                invalid += 1
+        except PatchError:
+            ok = False
+        apply_ms.append((time.perf_counter() - start) * 1000)
+
+        full_out = full['output_tokens'] or estimate_tokens(full['response'])
+        diff_out = diff['output_tokens'] or estimate_tokens(diff['response'])
+        full_tokens.append(full_out)
+        diff_tokens.append(diff_out)
+        full_latency.append(full['latency_s'])
+        diff_latency.append(diff['latency_s'])
+
+        # A diff that does not apply costs the diff call plus the full rewrite
+        applied += ok
+        effective_tokens.append(diff_out + (0 if ok else full_out))
+        effective_latency.append(diff['latency_s'] + (0 if ok else full['latency_s']))
+
+        print(f"{diff['file'][-32:]:<32} {full_out:>8} {diff_out:>8} "
+              f"{full['latency_s']:>7.1f} {diff['latency_s']:>7.1f} {'yes' if ok else 'NO':>8}")
+
+    n = len(pairs)
+    print('-' * 76)
+    print(f"\n{n} files, diff applied {applied}/{n} ({applied / n:.0%}), "
+          f"{invalid} applied to invalid Python, apply p95 {percentile(apply_ms, 0.95):.2f}ms")
+    print(f"\n{'':<28} {'tokens':>8} {'mean s':>8} {'p50 s':>8} {'p95 s':>8}")
+    for name, tokens, latency in (
+        ('full rewrite', full_tokens, full_latency),
+        ('diff (response only)', diff_tokens, diff_latency),
+        ('diff + fallback', effective_tokens, effective_latency),
+    ):
+        print(f"{name:<28} {sum(tokens):>8} {sum(latency) / n:>8.2f} "
+              f"{percentile(latency, 0.5):>8.2f} {percentile(latency, 0.95):>8.2f}")
+    print(f"\nDiff mode with fallback saves {1 - sum(effective_tokens) / max(sum(full_tokens), 1):.0%} "
+          f"of output tokens and {1 - sum(effective_latency) / max(sum(full_latency), 0.001):.0%} of latency")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('step', choices=['record', 'report'], nargs='?', default='report')
+    parser.add_argument('--recording', default=str(DEFAULT_RECORDING), help='JSON-lines recording file')
+    parser.add_argument('--corpus', default=str(BASE_DIR), help='Directory of source files (record)')
+    parser.add_argument('--pattern', default='*.py', help='Glob for corpus files (record)')
+    parser.add_argument('--language', default='python', help='Language hint sent to the model (record)')
+    parser.add_argument('--max-files', type=int, default=20, help='Files to record')
+    parser.add_argument('--max-chars', type=int, default=12000, help='Skip larger files (record)')
+    args = parser.parse_args()
+
+    if args.step == 'record':
+        record(args)
+    else:
+        report(args)
+
+
+if __name__ == '__main__':
+    main()
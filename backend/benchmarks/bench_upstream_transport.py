@@ -0,0 +1,240 @@
+"""
+Benchmark UpstreamTransport against a local stand-in for the model API
+
+Starts a local HTTPS server that speaks the Gemini REST API
+(generateContent and models.get, self-signed certificate via openssl,
+HTTP/1.1 keep-alive, idle connections closed like a load balancer would)
+and drives the real UpstreamTransport through google-generativeai, so the
+GAPIC client wiring, shared connection pool, warm-up and keep-alive pings
+are all exercised:
+
+  * cold: freshly built clients per call, no warm-up (TCP + TLS every time)
+  * warm: UpstreamTransport.start() with warm-up, then sequential calls
+  * after idle: first call after the server's idle timeout, with and
+    without keep-alive pings
+  * a concurrent burst with a 10-connection pool vs the pool sized by
+    utils.serving.upstream_pool_size
+
+--rtt-ms adds simulated network round trips: 2 per new connection
+(TCP + TLS 1.3) and 1 per request. gRPC mode needs an HTTP/2 stand-in and
+is not covered.
+
+Usage:
+    python benchmarks/bench_upstream_transport.py [--rtt-ms 20] [--requests 30]
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+import google.generativeai as genai
+
+from services.upstream_transport import UpstreamTransport
+from utils.serving import upstream_pool_size
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, rtt: float, idle_timeout: float, context: ssl.SSLContext):
+        super().__init__(address, StandInHandler)
+        self.rtt = rtt
+        self.idle_timeout = idle_timeout
+        self.context = context
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        # Runs on the per-connection thread: simulate TCP + TLS round trips,
+        # then do the real TLS handshake
+        with self.lock:
+            self.connections += 1
+        time.sleep(2 * self.rtt)
+        try:
+            tls = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(tls, client_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Close connections idle for longer than the server's idle timeout
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def reply(self, payload):
+        time.sleep(self.server.rtt)
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # models.get, used by warm-up and keep-alive pings
+        self.reply({'name': 'models/stand-in', 'inputTokenLimit': 1000000, 'outputTokenLimit': 8192})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.reply({
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': 'ok'}]}, 'finishReason': 'STOP'}],
+            'usageMetadata': {'promptTokenCount': 1, 'candidatesTokenCount': 1, 'totalTokenCount': 2}
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+def make_certificate(directory: str):
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-keyout', key, '-out', cert, '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def summarise(timings):
+    ordered = sorted(timings)
+    return (sum(ordered) / len(ordered) * 1000,
+            ordered[len(ordered) // 2] * 1000,
+            ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000)
+
+
+def make_transport(pool_size: int, keepalive: float = 0) -> UpstreamTransport:
+    os.environ['UPSTREAM_POOL_SIZE'] = str(pool_size)
+    os.environ['UPSTREAM_KEEPALIVE_SECONDS'] = str(keepalive)
+    return UpstreamTransport('bench-key', 'stand-in')
+
+
+def started(transport: UpstreamTransport) -> UpstreamTransport:
+    """start() and wait for its background warm-up to finish"""
+    transport.start()
+    while transport.stats['warmups'] == 0:
+        time.sleep(0.01)
+    return transport
+
+
+def stop(transport: UpstreamTransport) -> None:
+    # The keep-alive thread exits once the transport no longer owns this pid
+    transport.pid = None
+
+
+def caller(transport: UpstreamTransport):
+    """One generate_content call through google-generativeai on this transport's clients"""
+    model = genai.GenerativeModel('stand-in')
+    model._client = transport.clients['generative']
+
+    def call():
+        start = time.perf_counter()
+        transport.touch()
+        model.generate_content('hello').text
+        return time.perf_counter() - start
+    return call
+
+
+def row(name, timings, connections):
+    print(f"{name:<40} {'%8.1f %8.1f %8.1f' % summarise(timings)} {connections:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rtt-ms', type=float, default=20.0)
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--idle-timeout', type=float, default=1.5, help='Server closes idle connections after this')
+    parser.add_argument('--idle-rounds', type=int, default=3)
+    parser.add_argument('--in-flight', type=int, default=41, help='Admission in-flight limit to size the pool for')
+    parser.add_argument('--explain-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    cert, key = make_certificate(directory)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+
+    server = StandInServer(('127.0.0.1', 0), args.rtt_ms / 1000, args.idle_timeout, context)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['UPSTREAM_ENDPOINT'] = f"localhost:{server.server_address[1]}"
+    os.environ['UPSTREAM_TRANSPORT'] = 'rest'
+    os.environ['UPSTREAM_WARM_CONNECTIONS'] = '2'
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+
+    print(f"Stand-in RTT {args.rtt_ms:.0f}ms, idle timeout {args.idle_timeout}s, "
+          f"{args.requests} sequential requests\n")
+    print(f"{'case':<40} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'conns':>6}")
+    print('-' * 74)
+
+    # Cold: clients (and their connection pool) rebuilt for every call
+    before = server.connections
+    cold = []
+    for _ in range(args.requests):
+        transport = make_transport(10)
+        transport._build_clients()
+        cold.append(caller(transport)())
+    row('cold (fresh clients, no warm-up)', cold, server.connections - before)
+
+    # Warm: start() opens connections ahead of the first call
+    before = server.connections
+    transport = started(make_transport(10))
+    call = caller(transport)
+    warm = [call() for _ in range(args.requests)]
+    row('warm (start() + pooled keep-alive)', warm, server.connections - before)
+    stop(transport)
+
+    # First call after an idle period longer than the server's idle timeout
+    for name, keepalive in (('after idle, no keep-alive', 0), ('after idle, keep-alive pings', args.idle_timeout / 3)):
+        transport = started(make_transport(10, keepalive))
+        call = caller(transport)
+        call()
+        before = server.connections
+        timings = []
+        for _ in range(args.idle_rounds):
+            time.sleep(args.idle_timeout * 2)
+            timings.append(call())
+        row(name, timings, server.connections - before)
+        stop(transport)
+
+    # Burst of every call a worker can have in flight
+    sized = upstream_pool_size(args.in_flight, args.explain_workers)
+    for name, pool_size in (('burst, pool 10', 10), (f'burst, pool {sized} (upstream_pool_size)', sized)):
+        transport = started(make_transport(pool_size))
+        call = caller(transport)
+        with ThreadPoolExecutor(max_workers=sized) as pool:
+            list(pool.map(lambda _: call(), range(sized)))
+            before = server.connections
+            timings = []
+            for _ in range(3):
+                timings.extend(pool.map(lambda _: call(), range(sized)))
+        row(name, timings, server.connections - before)
+        metrics = transport.metrics()
+        stop(transport)
+
+    saved = summarise(cold)[0] - summarise(warm)[0]
+    print(f"\nWarm connections save {saved:.1f}ms per request "
+          f"({saved / max(args.rtt_ms, 0.001):.1f} RTTs + TLS CPU)")
+    print(f"Transport metrics: {metrics}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
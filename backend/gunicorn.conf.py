@@ -0,0 +1,98 @@
+"""
+Gunicorn production profile for the Coding Chatbot API
+
+    gunicorn -c gunicorn.conf.py
+
+Workers and threads are sized from the container's CPU/memory limits and
+the expected upstream latency (see utils/serving.recommend). With the
+default latency figures threads always sit at the 64-per-worker cap. Every
+value can be overridden through the environment:
+
+    WEB_CONCURRENCY         worker processes
+    GUNICORN_THREADS        threads per worker
+    UPSTREAM_LATENCY        expected seconds per model call (default 8)
+    CPU_MS_PER_REQUEST      app CPU time per request (default 15)
+    GUNICORN_PRELOAD        load the app in the master (default true)
+    GUNICORN_MAX_REQUESTS   recycle a worker after N requests (default 1000; off
+                            with a single worker)
+    UPSTREAM_POOL_SIZE      pooled upstream connections per worker (default: admission
+                            in-flight + EXPLAIN_MAX_WORKERS + 1)
+
+Upstream connections are never opened in the master: each worker builds
+and warms its own pool right after fork (see services/upstream_transport).
+
+With preload on, GeminiService, the explanation cache and the artifact
+store are built once in the master and shared copy-on-write. A plain
+SIGHUP then restarts workers without re-importing code; to deploy new code
+without downtime send USR2 (start a new master) followed by WINCH/TERM to
+the old one, or set GUNICORN_PRELOAD=false so SIGHUP reloads code too.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.serving import admission_limits, available_cpus, available_memory_mb, recommend, upstream_pool_size
+
+
+_profile = recommend(
+    cpus=available_cpus(),
+    memory_mb=available_memory_mb(),
+    upstream_latency=float(os.getenv('UPSTREAM_LATENCY', 8)),
+    cpu_ms_per_request=float(os.getenv('CPU_MS_PER_REQUEST', 15))
+)
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', _profile['workers']))
+threads = int(os.getenv('GUNICORN_THREADS', _profile['threads']))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers to bound slow leaks; jitter avoids all restarting at once.
+# A lone worker is never recycled: while it restarts nothing would answer
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000)) if workers > 1 else 0
+max_requests_jitter = max_requests // 10
+
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+# Keep admission control inside the thread budget so queued requests can
+# never occupy the threads health probes need
+_limits = admission_limits(threads)
+os.environ.setdefault('ADMISSION_MAX_IN_FLIGHT', str(_limits['admission_max_in_flight']))
+os.environ.setdefault('ADMISSION_MAX_QUEUE', str(_limits['admission_max_queue']))
+
+# One pooled upstream connection per call this worker can have in flight,
+# so load never spills onto short-lived connections
+os.environ.setdefault('UPSTREAM_POOL_SIZE', str(upstream_pool_size(
+    int(os.environ['ADMISSION_MAX_IN_FLIGHT']), int(os.getenv('EXPLAIN_MAX_WORKERS', 4))
+)))
+
+
+def when_ready(server):
+    server.log.info(
+        f"Serving with {workers} {worker_class} workers x {threads} threads "
+        f"(preload={preload_app}, max_requests={max_requests or 'off'}, "
+        f"admission in-flight={os.environ['ADMISSION_MAX_IN_FLIGHT']}, "
+        f"upstream pool={os.environ['UPSTREAM_POOL_SIZE']})"
+    )
+    if _profile['threads_capped'] and 'GUNICORN_THREADS' not in os.environ:
+        server.log.info("Threads per worker are at the recommended cap, not the latency/CPU ratio")
+
+
+def post_fork(server, worker):
+    # Don't share a trace file handle opened in the master between workers
+    from utils.tracing import tracer
+    tracer.file = None
+
+    # Open this worker's own upstream connections before traffic arrives
+    if server.cfg.preload_app:
+        from routes.api import gemini_service
+        gemini_service.transport.start()
@@ -6,15 +6,127 @@ from dotenv import load_dotenv
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(dotenv_path=BASE_DIR / '.env')
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from services.gemini_service import GeminiService
+from services.artifact_store import ArtifactStore
 from utils.validators import validate_prompt
-from utils.rate_limiter import rate_limit
+from utils.rate_limiter import enforce_rate_limit, rate_limit
 from utils.helpers import format_response, log_request
+from utils.tracing import tracer
+from utils.admission import ENDPOINT_CLASSES, Rejected, admission_controller
+from utils.admin import admin_required
+from utils.profiler import profiler_control, sampling_profiler, slow_request_log, thread_dump
+import json
+import re
 import time
 api_blueprint = Blueprint('api', __name__)
 gemini_service = GeminiService()
 
+# Persistent store of generated artifacts; also warms the response cache
+artifact_store = None
+if os.getenv('ARTIFACT_STORE_ENABLED', 'true').lower() == 'true':
+    try:
+        artifact_store = ArtifactStore(max_entries=int(os.getenv('ARTIFACT_MAX_ENTRIES', 50000)))
+        gemini_service.warm_cache(artifact_store)
+    except Exception as e:
+        print(f"[API] Artifact store disabled: {e}")
+        artifact_store = None
+
+store_chat_history = os.getenv('ARTIFACT_STORE_CHAT_HISTORY', 'false').lower() == 'true'
+
+
+@api_blueprint.before_request
+def apply_profiler_control():
+    """Pick up profiler and slow-request settings published by any worker"""
+    profiler_control.poll()
+
+
+@api_blueprint.before_request
+def start_trace():
+    """Open the root span for this request (continuing the caller's traceparent if sent)"""
+    span = tracer.start_trace(
+        f"{request.method} {request.path}",
+        request.headers.get('traceparent'),
+        record=slow_request_log.enabled,
+        **{'http.method': request.method, 'http.route': request.path}
+    )
+    g.trace_span = span.__enter__()
+
+
+@api_blueprint.after_request
+def tag_trace(response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        if span.sampled:
+            response.headers['traceparent'] = span.traceparent
+    return response
+
+
+@api_blueprint.teardown_request
+def end_trace(error=None):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.__exit__(type(error) if error else None, error, None)
+        if span.recorder is not None:
+            slow_request_log.capture(span)
+
+
+admission_enabled = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+
+
+# Per-IP limits are checked before admission, so a client over its limit
+# never holds a slot or queue position
+api_blueprint.before_request(enforce_rate_limit)
+
+
+@api_blueprint.before_request
+def admit_request():
+    """Queue or shed the request according to its priority class"""
+    if not admission_enabled or request.method == 'OPTIONS':
+        return None
+    
+    priority_class = ENDPOINT_CLASSES.get(request.endpoint, 'interactive')
+    try:
+        with tracer.span('admission.wait', priority_class=priority_class) as span:
+            queue_time = admission_controller.acquire(priority_class)
+            span.set_attribute('queue_ms', round(queue_time * 1000, 3))
+    except Rejected as e:
+        response = jsonify({
+            'success': False,
+            'error': f'{e.reason}. Please retry in {e.retry_after} seconds.'
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    
+    g.admission_class = priority_class
+    g.admission_start = time.monotonic()
+    return None
+
+
+@api_blueprint.teardown_request
+def release_admission(error=None):
+    priority_class = g.pop('admission_class', None)
+    if priority_class is not None:
+        admission_controller.release(priority_class, time.monotonic() - g.pop('admission_start'))
+
+
+def record_artifact(kind: str, prompt: str, params: dict, output, execution_time: float):
+    """Persist a generated result, returning its hash (None if the store is unavailable)"""
+    if artifact_store is None:
+        return None
+    try:
+        with tracer.span('artifact.record', kind=kind):
+            if not isinstance(output, str):
+                output = json.dumps(output)
+            return artifact_store.put(
+                kind, gemini_service.model_name, prompt, params, output,
+                {'execution_time': round(execution_time, 3)}
+            )
+    except Exception as e:
+        print(f"[API] Failed to record artifact: {e}")
+        return None
+
 @api_blueprint.route('/generate', methods=['POST'])
 @rate_limit(max_requests=10, window_seconds=60)  # 10 requests per minute
 def generate_code():
@@ -43,7 +155,8 @@ def generate_code():
         log_request(request)
         
         # Validate request data
-        data = request.get_json()
+        with tracer.span('request.parse_json'):
+            data = request.get_json()
         if not data:
             return jsonify({
                 'success': False,
@@ -55,7 +168,8 @@ def generate_code():
         temperature = float(data.get('temperature', 0.2))
         
         # Validate inputs
-        validation_error = validate_prompt(prompt, temperature)
+        with tracer.span('request.validate'):
+            validation_error = validate_prompt(prompt, temperature)
         if validation_error:
             return jsonify({
                 'success': False,
@@ -70,12 +184,18 @@ def generate_code():
         )
         
         execution_time = time.time() - start_time
+        artifact_id = record_artifact(
+            'generate', prompt,
+            {'language': language, 'temperature': temperature},
+            result, execution_time
+        )
         
         return jsonify({
             'success': True,
             'code': result['code'],
             'language': result['language'],
-            'execution_time': round(execution_time, 2)
+            'execution_time': round(execution_time, 2),
+            'artifact_id': artifact_id
         }), 200
         
     except ValueError as e:
@@ -106,7 +226,8 @@ def chat():
     try:
         start_time = time.time()
         
-        data = request.get_json()
+        with tracer.span('request.parse_json'):
+            data = request.get_json()
         if not data:
             return jsonify({
                 'success': False,
@@ -131,12 +252,18 @@ def chat():
         )
         
         execution_time = time.time() - start_time
+        # Earlier turns stay in the user's browser unless the operator opts in
+        params = {'language': language}
+        if store_chat_history:
+            params['history'] = history
+        artifact_id = record_artifact('chat', message, params, result['response'], execution_time)
         
         return jsonify({
             'success': True,
             'response': result['response'],
             'history': result['history'],
-            'execution_time': round(execution_time, 2)
+            'execution_time': round(execution_time, 2),
+            'artifact_id': artifact_id
         }), 200
         
     except Exception as e:
@@ -159,7 +286,10 @@ def explain_code():
         }
     """
     try:
-        data = request.get_json()
+        start_time = time.time()
+        
+        with tracer.span('request.parse_json'):
+            data = request.get_json()
         code = data.get('code', '').strip()
         language = data.get('language', 'auto')
         
@@ -170,10 +300,15 @@ def explain_code():
             }), 400
         
         explanation = gemini_service.explain_code(code, language)
+        artifact_id = record_artifact(
+            'explain', code, {'language': language},
+            explanation, time.time() - start_time
+        )
         
         return jsonify({
             'success': True,
-            'explanation': explanation
+            'explanation': explanation,
+            'artifact_id': artifact_id
         }), 200
         
     except Exception as e:
@@ -193,14 +328,22 @@ def improve_code():
         {
             "code": "string",
             "language": "string (optional)",
-            "focus": "string (optional: performance|readability|security)"
+            "focus": "string (optional: performance|readability|security)",
+            "mode": "string (optional: full|diff)"
         }
+    
+    In diff mode the response also carries the applied unified diff in
+    "patch"; "mode" reports which mode actually produced the result.
     """
     try:
-        data = request.get_json()
+        start_time = time.time()
+        
+        with tracer.span('request.parse_json'):
+            data = request.get_json()
         code = data.get('code', '').strip()
         language = data.get('language', 'auto')
         focus = data.get('focus', 'general')
+        mode = data.get('mode', 'full')
         
         if not code:
             return jsonify({
@@ -208,12 +351,26 @@ def improve_code():
                 'error': 'Code cannot be empty'
             }), 400
         
-        result = gemini_service.improve_code(code, language, focus)
+        if mode not in ('full', 'diff'):
+            return jsonify({
+                'success': False,
+                'error': "Mode must be 'full' or 'diff'"
+            }), 400
+        
+        result = gemini_service.improve_code(code, language, focus, mode)
+        artifact_id = record_artifact(
+            'improve', code,
+            {'language': language, 'focus': focus, 'mode': mode},
+            result, time.time() - start_time
+        )
         
         return jsonify({
             'success': True,
             'improved_code': result['improved_code'],
-            'suggestions': result['suggestions']
+            'suggestions': result['suggestions'],
+            'patch': result['patch'],
+            'mode': result['mode'],
+            'artifact_id': artifact_id
         }), 200
         
     except Exception as e:
@@ -237,3 +394,284 @@ def get_available_models():
             'success': False,
             'error': str(e)
         }), 500
+
+
+@api_blueprint.route('/admission', methods=['GET'])
+def get_admission_metrics():
+    """Queue depth, in-flight and shedding counters per priority class"""
+    return jsonify({
+        'success': True,
+        'enabled': admission_enabled,
+        'metrics': admission_controller.metrics()
+    }), 200
+
+
+@api_blueprint.route('/upstream', methods=['GET'])
+def get_upstream_metrics():
+    """Upstream transport mode, warm-up/keep-alive counters and connection pool stats"""
+    return jsonify({
+        'success': True,
+        'metrics': gemini_service.transport.metrics()
+    }), 200
+
+
+@api_blueprint.route('/budget', methods=['GET'])
+def get_budget_metrics():
+    """Output-token budget predicted vs used, truncation rate and learned multiple per request type"""
+    return jsonify({
+        'success': True,
+        'metrics': gemini_service.budget_planner.metrics()
+    }), 200
+
+
+@api_blueprint.route('/artifacts/<artifact_id>', methods=['GET'])
+@admin_required
+def get_artifact(artifact_id):
+    """
+    Fetch a stored artifact by full hash or unique hash prefix (min 6 chars)
+    
+    Artifacts hold every user's prompts and outputs, so this is admin-only.
+    
+    Response:
+        {
+            "success": bool,
+            "artifact": {"hash", "kind", "model", "prompt", "params", "output", "timings", "created_at"}
+        }
+    """
+    if artifact_store is None:
+        return jsonify({
+            'success': False,
+            'error': 'Artifact store is disabled'
+        }), 503
+    
+    artifact_id = artifact_id.lower()
+    if not re.fullmatch(r'[0-9a-f]{6,64}', artifact_id):
+        return jsonify({
+            'success': False,
+            'error': 'Artifact id must be 6-64 hex characters'
+        }), 400
+    
+    try:
+        artifact = artifact_store.get(artifact_id)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    if artifact is None:
+        return jsonify({
+            'success': False,
+            'error': 'Artifact not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'artifact': artifact
+    }), 200
+
+
+@api_blueprint.route('/artifacts', methods=['GET'])
+@admin_required
+def search_artifacts():
+    """
+    Search stored artifacts (admin-only)
+    
+    Query Parameters:
+        q: full-text query over prompts and outputs (optional)
+        prefix: hash prefix (optional)
+        kind: generate|chat|explain|improve|explain-chunk|explain-reduce (optional)
+        limit: maximum results, 1-100 (optional, default 20)
+    """
+    if artifact_store is None:
+        return jsonify({
+            'success': False,
+            'error': 'Artifact store is disabled'
+        }), 503
+    
+    try:
+        prefix = request.args.get('prefix', '').lower()
+        if prefix and not re.fullmatch(r'[0-9a-f]{1,64}', prefix):
+            return jsonify({
+                'success': False,
+                'error': 'Prefix must be hex characters'
+            }), 400
+        
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        results = artifact_store.search(
+            query=request.args.get('q', '').strip(),
+            prefix=prefix,
+            kind=request.args.get('kind'),
+            limit=limit
+        )
+        
+        return jsonify({
+            'success': True,
+            'artifacts': results
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid input: {str(e)}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Artifact search failed: {str(e)}'
+        }), 500
+
+
+@api_blueprint.route('/admin/profile', methods=['GET'])
+@admin_required
+def get_profile():
+    """
+    Collapsed stacks from the sampling profilers of all workers
+    
+    Returns text/plain, one "frame;frame;frame count" line per stack, ready
+    for flamegraph.pl, speedscope or inferno. Works while running or after
+    stop; running workers refresh their share about once a second.
+    """
+    collapsed, status = profiler_control.merged_profile()
+    return collapsed, 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'X-Profile-Samples': str(status['samples']),
+        'X-Profile-Running': str(status['running']).lower(),
+        'X-Profile-Workers': ','.join(str(pid) for pid in status['workers'])
+    }
+
+
+@api_blueprint.route('/admin/profile', methods=['POST'])
+@admin_required
+def control_profile():
+    """
+    Start or stop the sampling profiler in every worker
+    
+    Workers pick the change up on their next request (within
+    PROFILER_POLL_SECONDS); the worker that answers applies it at once.
+    
+    Request body:
+        {
+            "action": "start" | "stop",
+            "interval_ms": float (optional, default 10),
+            "seconds": float (optional, stops automatically; capped by PROFILE_MAX_SECONDS)
+        }
+    """
+    try:
+        data = request.get_json() or {}
+        action = data.get('action')
+        
+        if action == 'start':
+            if profiler_control.profile_running():
+                return jsonify({
+                    'success': False,
+                    'error': 'Profiler is already running'
+                }), 409
+            published = profiler_control.publish(
+                'profile',
+                action='start',
+                interval_ms=max(float(data.get('interval_ms', 10)), 1),
+                seconds=float(data['seconds']) if data.get('seconds') else None
+            )
+        elif action == 'stop':
+            published = profiler_control.publish('profile', action='stop')
+        else:
+            return jsonify({
+                'success': False,
+                'error': "Action must be 'start' or 'stop'"
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'published': published,
+            'profiler': sampling_profiler.status()
+        }), 200
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid input: {str(e)}'
+        }), 400
+
+
+@api_blueprint.route('/admin/slow-requests', methods=['GET'])
+@admin_required
+def get_slow_requests():
+    """
+    Stage timings of recent requests over the slow-request threshold, from all workers
+    
+    Query Parameters:
+        limit: maximum requests, most recent first (optional, default 20)
+    """
+    try:
+        limit = max(int(request.args.get('limit', 20)), 1)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Limit must be an integer'
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'threshold_ms': slow_request_log.threshold_ms,
+        'capacity': slow_request_log.entries.maxlen,
+        'requests': profiler_control.merged_slow_requests(limit)
+    }), 200
+
+
+@api_blueprint.route('/admin/slow-requests', methods=['POST'])
+@admin_required
+def configure_slow_requests():
+    """
+    Change the slow-request threshold of every worker at runtime
+    
+    Request body:
+        {
+            "threshold_ms": float (0 disables capture),
+            "capacity": int (optional, ring buffer size)
+        }
+    """
+    try:
+        data = request.get_json() or {}
+        if 'threshold_ms' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'threshold_ms is required'
+            }), 400
+        
+        profiler_control.publish(
+            'slow_requests',
+            threshold_ms=max(float(data['threshold_ms']), 0),
+            capacity=int(data['capacity']) if data.get('capacity') else None
+        )
+        
+        return jsonify({
+            'success': True,
+            'threshold_ms': slow_request_log.threshold_ms,
+            'capacity': slow_request_log.entries.maxlen
+        }), 200
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid input: {str(e)}'
+        }), 400
+
+
+@api_blueprint.route('/admin/slow-requests', methods=['DELETE'])
+@admin_required
+def clear_slow_requests():
+    """Empty the slow-request ring buffers of every worker"""
+    profiler_control.clear_slow_requests()
+    return jsonify({'success': True}), 200
+
+
+@api_blueprint.route('/admin/threads', methods=['GET'])
+@admin_required
+def get_thread_dump():
+    """Current stack of every thread in the worker that answers"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'threads': thread_dump()
+    }), 200
@@ -0,0 +1,398 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.cache import content_hash
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt BLOB NOT NULL,
+    params TEXT NOT NULL,
+    output BLOB NOT NULL,
+    timings TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_kind_created ON artifacts(kind, created_at);
+CREATE INDEX IF NOT EXISTS idx_artifacts_accessed ON artifacts(accessed_at);
+CREATE TABLE IF NOT EXISTS output_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    language TEXT NOT NULL,
+    multiple REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Output-size samples kept for the output budget planner
+MAX_OUTPUT_SAMPLES = 20000
+
+# Cache hits are written back to accessed_at in batches of this many, or
+# at least this often
+TOUCH_BATCH = 100
+TOUCH_INTERVAL_SECONDS = 5.0
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS artifacts_fts USING fts5(
+    hash UNINDEXED, kind UNINDEXED, prompt, output
+);
+"""
+
+
+def artifact_hash(kind: str, model: str, prompt: str, params: Optional[Dict] = None) -> str:
+    """Content address of a generation request"""
+    return content_hash(kind, model, prompt, json.dumps(params or {}, sort_keys=True))
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of generated artifacts
+
+    Backed by SQLite in WAL mode, so readers never block the writer and
+    several gunicorn workers can share one database file. Prompts and
+    outputs are zlib-compressed; a separate FTS5 table holds the plain text
+    for search. Each thread gets its own connection.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 50000):
+        self.path = path or os.getenv(
+            'ARTIFACT_DB_PATH', str(BASE_DIR / 'data' / 'artifacts.db')
+        )
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.compaction_lock = threading.Lock()
+        self.writes_since_compaction = 0
+        self.touch_lock = threading.Lock()
+        self.touched = {}
+        self.touches_flushed_at = time.monotonic()
+
+        if self.path != ':memory:':
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+        conn = self._connection()
+        # auto_vacuum must be set before the first table is created
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to hash/kind filters
+            self.fts_enabled = False
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Per-thread connection (sqlite3 connections are not thread-safe)
+
+        Connections are also never reused across a fork, so a store created
+        in a preloading master process is safe to use in its workers.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def put(
+        self,
+        kind: str,
+        model: str,
+        prompt: str,
+        params: Optional[Dict],
+        output: str,
+        timings: Optional[Dict] = None
+    ) -> str:
+        """
+        Record a generated artifact
+
+        Args:
+            kind: Request type (generate, chat, explain, improve, explain-chunk, ...)
+            model: Model name used
+            prompt: Prompt or input the output was generated from
+            params: Generation parameters that affect the output
+            output: Generated text
+            timings: Stage timings in seconds
+
+        Returns:
+            Content hash of the artifact
+        """
+        key = artifact_hash(kind, model, prompt, params)
+        now = time.time()
+        conn = self._connection()
+
+        with conn:
+            cursor = conn.execute(
+                """INSERT OR IGNORE INTO artifacts
+                   (hash, kind, model, prompt, params, output, timings, created_at, accessed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    key, kind, model,
+                    zlib.compress(prompt.encode('utf-8')),
+                    json.dumps(params or {}, sort_keys=True),
+                    zlib.compress(output.encode('utf-8')),
+                    json.dumps(timings or {}),
+                    now, now
+                )
+            )
+            if cursor.rowcount and self.fts_enabled:
+                conn.execute(
+                    "INSERT INTO artifacts_fts (hash, kind, prompt, output) VALUES (?, ?, ?, ?)",
+                    (key, kind, prompt, output)
+                )
+
+        if cursor.rowcount:
+            self.writes_since_compaction += 1
+            if self.writes_since_compaction >= max(self.max_entries // 10, 1):
+                self.compact_async()
+
+        return key
+
+    def _row_to_dict(self, row: sqlite3.Row, include_prompt: bool = True) -> Dict:
+        artifact = {
+            'hash': row['hash'],
+            'kind': row['kind'],
+            'model': row['model'],
+            'params': json.loads(row['params']),
+            'timings': json.loads(row['timings']),
+            'created_at': row['created_at']
+        }
+        if include_prompt:
+            artifact['prompt'] = zlib.decompress(row['prompt']).decode('utf-8')
+            artifact['output'] = zlib.decompress(row['output']).decode('utf-8')
+        return artifact
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Look up an artifact by full hash or unique hash prefix
+
+        Raises:
+            ValueError: If a prefix matches more than one artifact
+        """
+        conn = self._connection()
+        if len(key) == 64:
+            rows = conn.execute("SELECT * FROM artifacts WHERE hash = ?", (key,)).fetchall()
+        else:
+            # Range scan on the primary key index
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE hash >= ? AND hash < ? LIMIT 2",
+                (key, key + 'g')
+            ).fetchall()
+
+        if not rows:
+            return None
+        if len(rows) > 1:
+            raise ValueError(f"Ambiguous artifact prefix: {key}")
+
+        with conn:
+            conn.execute(
+                "UPDATE artifacts SET accessed_at = ? WHERE hash = ?",
+                (time.time(), rows[0]['hash'])
+            )
+        return self._row_to_dict(rows[0])
+
+    def lookup_output(self, kind: str, model: str, prompt: str, params: Optional[Dict] = None) -> Optional[str]:
+        """Return a previously generated output for an identical request, if any"""
+        row = self._connection().execute(
+            "SELECT output FROM artifacts WHERE hash = ?",
+            (artifact_hash(kind, model, prompt, params),)
+        ).fetchone()
+        if row is None:
+            return None
+        self.touch(artifact_hash(kind, model, prompt, params))
+        return zlib.decompress(row['output']).decode('utf-8')
+
+    def touch(self, key: str) -> None:
+        """
+        Mark an artifact as used, so compaction keeps it
+
+        Read-through cache hits call this on every hit; the access times are
+        buffered and written in one transaction per TOUCH_BATCH hits or
+        TOUCH_INTERVAL_SECONDS, whichever comes first.
+        """
+        with self.touch_lock:
+            self.touched[key] = time.time()
+            due = (len(self.touched) >= TOUCH_BATCH
+                   or time.monotonic() - self.touches_flushed_at >= TOUCH_INTERVAL_SECONDS)
+        if due:
+            self.flush_touches()
+
+    def flush_touches(self) -> int:
+        """Write buffered access times; returns the number of artifacts updated"""
+        with self.touch_lock:
+            touched, self.touched = self.touched, {}
+            self.touches_flushed_at = time.monotonic()
+        if not touched:
+            return 0
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE artifacts SET accessed_at = MAX(accessed_at, ?) WHERE hash = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()]
+            )
+        return len(touched)
+
+    def search(
+        self,
+        query: str = '',
+        prefix: str = '',
+        kind: Optional[str] = None,
+        limit: int = 20
+    ) -> List[Dict]:
+        """
+        Search artifacts by hash prefix and/or full text
+
+        Args:
+            query: Full-text query over prompts and outputs
+            prefix: Hash prefix
+            kind: Restrict to one request type
+            limit: Maximum number of results
+
+        Returns:
+            Artifact summaries (without prompt/output bodies), newest first
+        """
+        conn = self._connection()
+        clauses = []
+        args = []
+
+        if prefix:
+            clauses.append("a.hash >= ? AND a.hash < ?")
+            args.extend([prefix, prefix + 'g'])
+        if kind:
+            clauses.append("a.kind = ?")
+            args.append(kind)
+
+        if query and self.fts_enabled:
+            sql = ("SELECT a.* FROM artifacts_fts f JOIN artifacts a ON a.hash = f.hash "
+                   "WHERE artifacts_fts MATCH ?")
+            # Quote the query so user input is treated as phrase terms, not FTS syntax
+            args.insert(0, ' '.join('"' + term.replace('"', '""') + '"' for term in query.split()))
+            if clauses:
+                sql += " AND " + " AND ".join(clauses)
+            sql += " ORDER BY rank LIMIT ?"
+        else:
+            # Without FTS5 the bodies are only stored compressed, so only
+            # the hash/kind filters can be applied
+            sql = "SELECT a.* FROM artifacts a"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY a.created_at DESC LIMIT ?"
+        args.append(limit)
+
+        rows = conn.execute(sql, args).fetchall()
+        return [self._row_to_dict(row, include_prompt=False) for row in rows]
+
+    def recent(self, kinds: List[str], limit: int = 1000) -> Iterator[Tuple[str, str]]:
+        """Yield (hash, output) for the most recently used artifacts of the given kinds"""
+        placeholders = ', '.join('?' for _ in kinds)
+        rows = self._connection().execute(
+            f"SELECT hash, output FROM artifacts WHERE kind IN ({placeholders}) "
+            f"ORDER BY accessed_at DESC LIMIT ?",
+            (*kinds, limit)
+        )
+        for row in rows:
+            yield row['hash'], zlib.decompress(row['output']).decode('utf-8')
+
+    def put_output_sample(self, kind: str, language: str, multiple: float) -> None:
+        """Record one output-size sample for the output budget planner"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO output_samples (kind, language, multiple, created_at) VALUES (?, ?, ?, ?)",
+                (kind, language, multiple, time.time())
+            )
+
+    def output_samples(self, limit: int = 10000) -> List[Tuple[str, str, float]]:
+        """(kind, language, multiple) for the most recent output-size samples, oldest first"""
+        rows = self._connection().execute(
+            "SELECT kind, language, multiple FROM output_samples ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [(row['kind'], row['language'], row['multiple']) for row in reversed(rows)]
+
+    def compact(self, batch_size: int = 500) -> int:
+        """
+        Evict least recently used artifacts beyond max_entries
+
+        Deletes in small batches, each in its own short transaction, so
+        concurrent writers only ever wait for one batch. Freed pages are
+        returned to the filesystem incrementally.
+
+        Returns:
+            Number of artifacts evicted
+        """
+        conn = self._connection()
+        evicted = 0
+        # Recent hits must count before choosing what to evict
+        self.flush_touches()
+
+        while True:
+            total = conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+            excess = min(total - self.max_entries, batch_size)
+            if excess <= 0:
+                break
+
+            hashes = [row[0] for row in conn.execute(
+                "SELECT hash FROM artifacts ORDER BY accessed_at LIMIT ?", (excess,)
+            )]
+            placeholders = ', '.join('?' for _ in hashes)
+            with conn:
+                conn.execute(f"DELETE FROM artifacts WHERE hash IN ({placeholders})", hashes)
+                if self.fts_enabled:
+                    conn.execute(f"DELETE FROM artifacts_fts WHERE hash IN ({placeholders})", hashes)
+            evicted += len(hashes)
+
+        with conn:
+            conn.execute(
+                "DELETE FROM output_samples WHERE id <= (SELECT MAX(id) FROM output_samples) - ?",
+                (MAX_OUTPUT_SAMPLES,)
+            )
+
+        conn.execute("PRAGMA incremental_vacuum(1000)")
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return evicted
+
+    def compact_async(self) -> bool:
+        """Run compaction on a background thread; returns False if one is already running"""
+        if not self.compaction_lock.acquire(blocking=False):
+            return False
+        self.writes_since_compaction = 0
+
+        def run():
+            try:
+                evicted = self.compact()
+                if evicted:
+                    print(f"[ArtifactStore] Compaction evicted {evicted} artifacts")
+            except Exception as e:
+                print(f"[ArtifactStore] Compaction failed: {e}")
+            finally:
+                self.compaction_lock.release()
+
+        threading.Thread(target=run, name='artifact-compaction', daemon=True).start()
+        return True
+
+    def stats(self) -> Dict:
+        """Entry counts per kind"""
+        rows = self._connection().execute(
+            "SELECT kind, COUNT(*) AS count FROM artifacts GROUP BY kind"
+        ).fetchall()
+        return {
+            'path': self.path,
+            'max_entries': self.max_entries,
+            'fts_enabled': self.fts_enabled,
+            'kinds': {row['kind']: row['count'] for row in rows}
+        }
@@ -8,8 +8,24 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(dotenv_path=BASE_DIR / '.env')
 
 import google.generativeai as genai
+import contextvars
+import threading
 import time
+from functools import partial
 from typing import Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from utils.cache import LRUCache
+from services.artifact_store import artifact_hash
+from utils.chunking import split_code
+from utils.patching import PatchError, apply_patch, extract_diff
+from utils.tracing import tracer
+from services.upstream_transport import UpstreamTransport
+from utils.helpers import estimate_tokens
+from utils.output_budget import join_continuation, output_budget_planner
+
+
+MAX_TOKENS = genai.protos.Candidate.FinishReason.MAX_TOKENS
+CONTINUE_PROMPT = "Continue exactly where you stopped. Do not repeat anything already written."
 
 
 class GeminiService:
@@ -24,14 +40,99 @@ class GeminiService:
         if not api_key.strip():
             raise ValueError("GEMINI_API_KEY is empty")
         
-        # Configure the Gemini API
-        genai.configure(api_key=api_key)
-        
         self.model_name = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+        
+        # Configure the Gemini API through a pooled, warmed transport
+        self.transport = UpstreamTransport(api_key, self.model_name)
         self.max_output_tokens = int(os.getenv('MAX_OUTPUT_TOKENS', 4096))
+        self.max_continuations = int(os.getenv('MAX_CONTINUATIONS', 2))
+        # Stream upstream responses so traces separate time to first token
+        # from generation time
+        self.stream_responses = os.getenv('UPSTREAM_STREAMING', 'true').lower() == 'true'
+        self.budget_planner = output_budget_planner
+        
+        # Large-input explanation pipeline
+        self.explain_chunk_chars = int(os.getenv('EXPLAIN_CHUNK_CHARS', 4000))
+        self.explain_max_workers = int(os.getenv('EXPLAIN_MAX_WORKERS', 4))
+        # Chunks one request may have queued or running in the shared pool
+        self.explain_per_request = max(int(os.getenv('EXPLAIN_MAX_PER_REQUEST', 2)), 1)
+        self.explain_pool = None
+        self.explain_pool_pid = None
+        self.explain_pool_lock = threading.Lock()
+        self.explain_cache = LRUCache(int(os.getenv('EXPLAIN_CACHE_ENTRIES', 2048)))
+        
+        # Optional persistent ArtifactStore, attached by the API layer
+        self.artifact_store = None
         
         print(f"[GeminiService] Initialized with model: {self.model_name}")
     
+    def _explain_executor(self) -> ThreadPoolExecutor:
+        """
+        Process-wide pool for chunk explanations
+
+        Shared by all requests so chunk fan-out adds at most
+        explain_max_workers upstream calls per worker, however many large
+        explain requests are in flight. Each request keeps at most
+        explain_per_request chunks in it (see explain_code), so concurrent
+        requests interleave instead of queueing behind each other. Created
+        lazily per process, as a pool inherited across fork has no threads.
+        """
+        with self.explain_pool_lock:
+            if self.explain_pool_pid != os.getpid():
+                self.explain_pool = ThreadPoolExecutor(
+                    max_workers=self.explain_max_workers, thread_name_prefix='explain-chunk'
+                )
+                self.explain_pool_pid = os.getpid()
+            return self.explain_pool
+
+    def warm_cache(self, store, limit: int = 2000) -> int:
+        """Attach an artifact store and load recent explanation results from it"""
+        self.artifact_store = store
+        self.budget_planner.attach(store)
+        loaded = 0
+        for key, output in store.recent(['explain', 'explain-chunk', 'explain-reduce'], limit):
+            self.explain_cache.set(key, output)
+            loaded += 1
+        if loaded:
+            print(f"[GeminiService] Warmed explanation cache with {loaded} artifacts")
+        return loaded
+
+    def _cached_artifact(self, kind: str, prompt: str, params: Dict, generate) -> str:
+        """
+        Return the output of an identical earlier request, generating it on miss
+
+        Checks the in-process LRU first, then the shared artifact store, and
+        records fresh results in both.
+        """
+        key = artifact_hash(kind, self.model_name, prompt, params)
+        with tracer.span('cache.lookup', kind=kind) as span:
+            cached = self.explain_cache.get(key)
+            span.set_attribute('hit', 'memory' if cached is not None else 'miss')
+            if cached is not None and self.artifact_store is not None:
+                # Keep the shared copy alive for other workers and restarts
+                self.artifact_store.touch(key)
+            elif cached is None and self.artifact_store is not None:
+                cached = self.artifact_store.lookup_output(kind, self.model_name, prompt, params)
+                if cached is not None:
+                    span.set_attribute('hit', 'store')
+                    self.explain_cache.set(key, cached)
+        if cached is not None:
+            return cached
+
+        start_time = time.time()
+        output = generate()
+        self.explain_cache.set(key, output)
+
+        if self.artifact_store is not None:
+            try:
+                self.artifact_store.put(
+                    kind, self.model_name, prompt, params, output,
+                    {'generation_time': round(time.time() - start_time, 3)}
+                )
+            except Exception as e:
+                print(f"[GeminiService] Failed to record artifact: {e}")
+        return output
+
     def _retry_with_backoff(self, func, max_retries=3):
         """Simple retry logic with exponential backoff"""
         for attempt in range(max_retries):
@@ -42,7 +143,115 @@ class GeminiService:
                     raise e
                 wait_time = (2 ** attempt)
                 print(f"[GeminiService] Retry {attempt + 1}/{max_retries} after {wait_time}s...")
-                time.sleep(wait_time)
+                with tracer.span('gemini.retry_sleep', attempt=attempt + 1, wait_seconds=wait_time, error=str(e)):
+                    time.sleep(wait_time)
+
+    def _plan_budget(self, kind: str, input_text: str, language: str, generation_config: Dict) -> Dict:
+        """Fill in max_output_tokens and stop sequences from the output budget planner"""
+        cap = self.max_output_tokens if kind == 'generate' else None
+        plan = self.budget_planner.plan(kind, estimate_tokens(input_text), language, cap)
+        generation_config['max_output_tokens'] = plan['max_output_tokens']
+        if plan['stop_sequences']:
+            generation_config['stop_sequences'] = plan['stop_sequences']
+        return plan
+
+    def _length_hint(self, kind: str, input_text: str, language: str) -> str:
+        """Prompt line steering prose answers towards the planned size"""
+        plan = self.budget_planner.plan(kind, estimate_tokens(input_text), language)
+        return f"Keep the whole answer under about {max(int(plan['expected'] * 0.75), 100)} words."
+
+    @staticmethod
+    def _usage(response, text: str):
+        """(output tokens, hit the token cap) for one response"""
+        usage = getattr(response, 'usage_metadata', None)
+        tokens = getattr(usage, 'candidates_token_count', 0) or estimate_tokens(text)
+        candidates = getattr(response, 'candidates', None) or []
+        truncated = bool(candidates) and candidates[0].finish_reason == MAX_TOKENS
+        return tokens, truncated
+
+    def _send(self, call):
+        """
+        Run one upstream call and return its complete response
+
+        When streaming, the first chunk arrives once the prompt has been
+        processed and the first tokens generated, so the call is traced as
+        gemini.first_chunk (time to first token) followed by gemini.stream
+        (the rest of the generation). The resolved response carries the
+        whole answer's text, usage and finish reason either way.
+
+        Args:
+            call: generate_content or send_message with its arguments bound,
+                taking only stream
+        """
+        if not self.stream_responses:
+            return call(stream=False)
+
+        with tracer.span('gemini.first_chunk'):
+            # The first chunk is read before the response is returned
+            response = call(stream=True)
+        with tracer.span('gemini.stream'):
+            response.resolve()
+        return response
+
+    def _generate_content(
+        self,
+        prompt: str,
+        kind: Optional[str] = None,
+        input_text: str = '',
+        language: str = 'auto',
+        **generation_config
+    ) -> str:
+        """
+        Upstream generate_content call, traced as one span
+
+        With a request kind, max_output_tokens and stop sequences come from
+        the output budget planner. An answer cut off at the cap is resumed
+        with up to MAX_CONTINUATIONS follow-up calls, and the real output
+        size is fed back to the planner.
+        """
+        plan = self._plan_budget(kind, input_text or prompt, language, generation_config) if kind else None
+
+        with tracer.span('gemini.generate', model=self.model_name, prompt_chars=len(prompt), kind=kind,
+                         max_output_tokens=generation_config.get('max_output_tokens')) as span:
+            self.transport.touch()
+            model = genai.GenerativeModel(self.model_name)
+            contents = prompt
+            text = ''
+            output_tokens = 0
+            first_truncated = None
+
+            for continuation in range(self.max_continuations + 1):
+                response = self._send(partial(
+                    model.generate_content,
+                    contents,
+                    generation_config=genai.GenerationConfig(**generation_config)
+                ))
+                part = response.text
+                text = join_continuation(text, part)
+                tokens, truncated = self._usage(response, part)
+                output_tokens += tokens
+                if first_truncated is None:
+                    first_truncated = truncated
+                if not truncated or plan is None:
+                    break
+
+                # Resume from where the answer was cut, with the full cap
+                span.set_attribute('continuations', continuation + 1)
+                generation_config['max_output_tokens'] = plan['cap']
+                contents = [
+                    {'role': 'user', 'parts': [prompt]},
+                    {'role': 'model', 'parts': [text]},
+                    {'role': 'user', 'parts': [CONTINUE_PROMPT]}
+                ]
+
+            span.set_attribute('output_chars', len(text))
+            span.set_attribute('output_tokens', output_tokens)
+            if plan is not None:
+                self.budget_planner.record(
+                    kind, language, estimate_tokens(input_text or prompt),
+                    plan['max_output_tokens'], output_tokens, first_truncated
+                )
+            return text
     
     def generate_code(
         self, 
@@ -68,17 +277,15 @@ Requirements:
 Provide ONLY the code with inline comments. Do not include explanations outside the code."""
 
             def generate():
-                model = genai.GenerativeModel(self.model_name)
-                response = model.generate_content(
+                return self._generate_content(
                     formatted_prompt,
-                    generation_config=genai.GenerationConfig(
-                        temperature=temperature,
-                        max_output_tokens=self.max_output_tokens,
-                        top_p=0.95,
-                        top_k=40
-                    )
-                )
-                return response.text.strip()
+                    kind='generate',
+                    input_text=prompt,
+                    language=language,
+                    temperature=temperature,
+                    top_p=0.95,
+                    top_k=40
+                ).strip()
             
             code = self._retry_with_backoff(generate)
             detected_language = language if language != 'auto' else self._detect_language(code)
@@ -120,20 +327,54 @@ Be concise but thorough. Provide code examples when helpful."""
                 system_instruction=system_instruction
             )
             
-            chat = model.start_chat(history=[])
-            
             def send():
-                return chat.send_message(message)
+                generation_config = {}
+                plan = self._plan_budget('chat', message, language, generation_config)
+                
+                with tracer.span('gemini.send_message', model=self.model_name, prompt_chars=len(message),
+                                 max_output_tokens=plan['max_output_tokens']) as span:
+                    self.transport.touch()
+                    # Fresh chat per attempt so a failed retry leaves no partial turns
+                    chat = model.start_chat(history=[])
+                    text = ''
+                    output_tokens = 0
+                    first_truncated = None
+                    next_message = message
+                    
+                    for continuation in range(self.max_continuations + 1):
+                        response = self._send(partial(
+                            chat.send_message,
+                            next_message,
+                            generation_config=genai.GenerationConfig(**generation_config)
+                        ))
+                        text = join_continuation(text, response.text)
+                        tokens, truncated = self._usage(response, response.text)
+                        output_tokens += tokens
+                        if first_truncated is None:
+                            first_truncated = truncated
+                        if not truncated:
+                            break
+                        span.set_attribute('continuations', continuation + 1)
+                        generation_config['max_output_tokens'] = plan['cap']
+                        next_message = CONTINUE_PROMPT
+                    
+                    span.set_attribute('output_chars', len(text))
+                    span.set_attribute('output_tokens', output_tokens)
+                    self.budget_planner.record(
+                        'chat', language, estimate_tokens(message),
+                        plan['max_output_tokens'], output_tokens, first_truncated
+                    )
+                    return text
             
-            response = self._retry_with_backoff(send)
+            response_text = self._retry_with_backoff(send)
             
             updated_history = history + [
                 {'role': 'user', 'content': message},
-                {'role': 'model', 'content': response.text}
+                {'role': 'model', 'content': response_text}
             ]
             
             return {
-                'response': response.text,
+                'response': response_text,
                 'history': updated_history
             }
             
@@ -141,10 +382,78 @@ Be concise but thorough. Provide code examples when helpful."""
             raise Exception(f"Chat error: {str(e)}")
     
     def explain_code(self, code: str, language: str = 'auto') -> str:
-        """Explain existing code"""
+        """
+        Explain existing code
+
+        Inputs longer than one chunk go through a map-reduce pipeline:
+        the code is split at syntactic boundaries, chunks are explained in
+        parallel (with results cached by content hash, so an edited file
+        only re-explains the chunks that changed), and the per-chunk notes
+        are reduced into a single overview.
+        """
         try:
-            prompt = f"""Analyze and explain the following code in detail:
+            if len(code) <= self.explain_chunk_chars:
+                return self._explain_single(code, language)
+
+            with tracer.span('explain.split', input_chars=len(code)):
+                chunks = split_code(code, language, self.explain_chunk_chars)
+            if len(chunks) <= 1:
+                return self._explain_single(code, language)
+
+            with tracer.span('explain.map', chunks=len(chunks)):
+                sections = self._explain_chunks(chunks, language)
+
+            return self._reduce_explanations(sections, language)
+            
+        except Exception as e:
+            raise Exception(f"Code explanation error: {str(e)}")
+
+    def _explain_chunks(self, chunks: List[str], language: str) -> List[str]:
+        """
+        Explain chunks on the shared pool, explain_per_request at a time
+
+        Submitting every chunk at once would put a large file's whole
+        fan-out ahead of all later requests in the pool's FIFO queue; with
+        a small window per request, the pool alternates between requests.
+        """
+        pool = self._explain_executor()
+        pending = {}
+        sections = [None] * len(chunks)
+        remaining = iter(enumerate(chunks))
+
+        def submit_next():
+            for index, chunk in remaining:
+                # Each task runs in a copy of the caller's context so its
+                # spans nest under the current request trace
+                future = pool.submit(
+                    contextvars.copy_context().run,
+                    self._explain_chunk, chunk, language, index + 1, len(chunks)
+                )
+                pending[future] = index
+                return
+
+        for _ in range(self.explain_per_request):
+            submit_next()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sections[pending.pop(future)] = future.result()
+                    submit_next()
+        except Exception:
+            # Don't leave this request's queued chunks occupying the shared pool
+            for future in pending:
+                future.cancel()
+            raise
+        return sections
 
+    def _explain_single(self, code: str, language: str) -> str:
+        """Explain code that fits in a single prompt"""
+        prompt = f"""Analyze and explain the following code in detail:
+
+```{language if language != 'auto' else ''}
+{code}
+```
 
 Provide:
 1. High-level overview of what the code does
@@ -152,31 +461,93 @@ Provide:
 3. Any potential issues or improvements
 4. Time/space complexity if applicable
 
-Keep explanations clear and beginner-friendly."""
+Keep explanations clear and beginner-friendly. {self._length_hint('explain', code, language)}"""
 
-            def generate():
-                model = genai.GenerativeModel(self.model_name)
-                response = model.generate_content(
-                    prompt,
-                    generation_config=genai.GenerationConfig(
-                        temperature=0.3,
-                        max_output_tokens=2048
-                    )
-                )
-                return response.text
-            
-            return self._retry_with_backoff(generate)
-            
-        except Exception as e:
-            raise Exception(f"Code explanation error: {str(e)}")
+        def generate():
+            return self._generate_content(
+                prompt,
+                kind='explain',
+                input_text=code,
+                language=language,
+                temperature=0.3
+            )
+
+        return self._cached_artifact(
+            'explain', code, {'language': language},
+            lambda: self._retry_with_backoff(generate)
+        )
+
+    def _explain_chunk(self, chunk: str, language: str, index: int, total: int) -> str:
+        """Map step: explain one chunk, served from cache when unchanged"""
+        prompt = f"""You are explaining a large file piece by piece. This is part {index} of {total}:
+
+```{language if language != 'auto' else ''}
+{chunk}
+```
+
+Explain what each function, class or block in this part does, step by step, and note any potential issues. Do not summarise the whole file; only this part. Be concise. {self._length_hint('explain-chunk', chunk, language)}"""
+
+        def generate():
+            return self._generate_content(
+                prompt,
+                kind='explain-chunk',
+                input_text=chunk,
+                language=language,
+                temperature=0.3
+            )
+
+        return self._cached_artifact(
+            'explain-chunk', chunk, {'language': language},
+            lambda: self._retry_with_backoff(generate)
+        )
+
+    def _reduce_explanations(self, sections: List[str], language: str) -> str:
+        """Reduce step: merge per-chunk notes into one overview"""
+        notes = '\n\n'.join(
+            f"--- Part {index} ---\n{section}" for index, section in enumerate(sections, 1)
+        )
+        prompt = f"""Below are explanations of consecutive parts of one source file.
+
+{notes}
+
+Using only these notes, provide:
+1. High-level overview of what the code does
+2. How the parts fit together
+3. Any potential issues or improvements
+4. Time/space complexity if applicable
+
+Keep explanations clear and beginner-friendly. {self._length_hint('explain-reduce', notes, language)}"""
+
+        def generate():
+            return self._generate_content(
+                prompt,
+                kind='explain-reduce',
+                input_text=notes,
+                language=language,
+                temperature=0.3
+            )
+
+        def reduce():
+            overview = self._retry_with_backoff(generate)
+            return f"{overview}\n\n## Detailed walkthrough\n\n" + '\n\n'.join(sections)
+
+        return self._cached_artifact('explain-reduce', notes, {'language': language}, reduce)
     
     def improve_code(
         self,
         code: str,
         language: str = 'auto',
-        focus: str = 'general'
+        focus: str = 'general',
+        mode: str = 'full'
     ) -> Dict[str, str]:
-        """Improve and optimize existing code"""
+        """
+        Improve and optimize existing code
+
+        In 'diff' mode the model returns a unified diff against the submitted
+        code instead of a full rewrite, which keeps output tokens (and so
+        generation latency) proportional to the size of the change. If the
+        diff does not apply cleanly we fall back to a full rewrite.
+        """
         try:
             focus_instructions = {
                 'performance': 'Focus on performance optimization and efficiency',
@@ -184,12 +555,21 @@ Keep explanations clear and beginner-friendly."""
                 'security': 'Focus on security best practices and vulnerability fixes',
                 'general': 'Provide overall improvements across all aspects'
             }
-            
-            prompt = f"""Improve the following code:
+            focus_text = focus_instructions.get(focus, focus_instructions['general'])
+
+            if mode == 'diff':
+                try:
+                    return self._improve_code_diff(code, language, focus_text)
+                except PatchError as e:
+                    print(f"[GeminiService] Diff did not apply ({e}), retrying with full rewrite...")
 
+            prompt = f"""Improve the following code:
 
+```{language if language != 'auto' else ''}
+{code}
+```
 
-{focus_instructions.get(focus, focus_instructions['general'])}
+{focus_text}
 
 Provide:
 1. The improved version of the code
@@ -204,15 +584,13 @@ CHANGES:
 [list of improvements]"""
 
             def generate():
-                model = genai.GenerativeModel(self.model_name)
-                response = model.generate_content(
+                return self._generate_content(
                     prompt,
-                    generation_config=genai.GenerationConfig(
-                        temperature=0.2,
-                        max_output_tokens=3072
-                    )
+                    kind='improve',
+                    input_text=code,
+                    language=language,
+                    temperature=0.2
                 )
-                return response.text
             
             full_response = self._retry_with_backoff(generate)
             
@@ -223,11 +601,68 @@ CHANGES:
             
             return {
                 'improved_code': improved_code,
-                'suggestions': suggestions
+                'suggestions': suggestions,
+                'patch': None,
+                'mode': 'full'
             }
             
         except Exception as e:
             raise Exception(f"Code improvement error: {str(e)}")
+
+    def _improve_code_diff(self, code: str, language: str, focus_text: str) -> Dict[str, str]:
+        """Ask for a unified diff against the code and apply it locally"""
+        numbered = '\n'.join(
+            f"{number:>4} | {line}" for number, line in enumerate(code.splitlines(), 1)
+        )
+
+        prompt = f"""Improve the following code. Line numbers are shown for reference only and are not part of the code.
+
+{numbered}
+
+{focus_text}
+
+Return ONLY the edits as a unified diff against the original code (with --- a/code and +++ b/code headers and @@ hunk headers, 2 lines of unchanged context per hunk). Do not repeat unchanged code outside the hunks.
+
+Format:
+PATCH:
+```diff
+[unified diff here]
+```
+
+CHANGES:
+[short list of improvements]"""
+
+        def generate():
+            return self._generate_content(
+                prompt,
+                kind='improve-diff',
+                input_text=code,
+                language=language,
+                temperature=0.2
+            )
+
+        return self.apply_diff_response(code, self._retry_with_backoff(generate))
+
+    @staticmethod
+    def apply_diff_response(code: str, response: str) -> Dict[str, str]:
+        """
+        Apply a diff-mode model response to the submitted code
+
+        Raises:
+            PatchError: If the response holds no diff or it does not apply
+        """
+        parts = response.split('CHANGES:', 1)
+        patch = extract_diff(parts[0]).strip('\n') + '\n'
+        suggestions = parts[1].strip() if len(parts) > 1 else 'See patch above'
+
+        improved_code = apply_patch(code, patch)
+
+        return {
+            'improved_code': improved_code,
+            'suggestions': suggestions,
+            'patch': patch,
+            'mode': 'diff'
+        }
     
     def _detect_language(self, code: str) -> str:
         """Simple language detection based on code patterns"""
@@ -255,6 +690,7 @@ CHANGES:
     def list_models(self) -> List[str]:
         """List available Gemini models"""
         try:
+            self.transport.touch()
             models = genai.list_models()
             return [model.name for model in models if 'gemini' in model.name.lower()]
         except Exception:
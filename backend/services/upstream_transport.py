@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+import requests
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc import GenerativeServiceGrpcTransport
+from google.ai.generativelanguage_v1beta.services.model_service.transports.grpc import ModelServiceGrpcTransport
+from google.generativeai import client as genai_client
+from requests.adapters import HTTPAdapter
+
+try:
+    # Private helper; requirements.txt pins the google-auth version it was
+    # written against, and the transport falls back to genai's own clients
+    # if it is missing
+    from google.auth._default import get_api_key_credentials
+except ImportError:
+    get_api_key_credentials = None
+
+from utils.serving import upstream_pool_size
+
+
+def build_session(
+    pool_size: int,
+    session: Optional[requests.Session] = None,
+    adapter: Optional[HTTPAdapter] = None
+) -> requests.Session:
+    """
+    Mount a keep-alive connection pool sized for our thread count
+
+    requests' default adapter keeps at most 10 connections per host and
+    silently discards the rest, so under load extra threads pay a fresh
+    TCP + TLS handshake on every call. pool_block=False lets bursts beyond
+    the pool still go through (on a temporary connection). Passing the same
+    adapter to several sessions makes them share one pool.
+    """
+    session = session or requests.Session()
+    adapter = adapter or HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def pool_metrics(session: requests.Session) -> list:
+    """Per-host connection pool counters from urllib3"""
+    pools = []
+    adapter = session.get_adapter('https://')
+    for key in list(adapter.poolmanager.pools.keys()):
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is None:
+            continue
+        pools.append({
+            'host': pool.host,
+            'port': pool.port,
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            'idle_connections': pool.pool.qsize() if pool.pool else 0
+        })
+    return pools
+
+
+class UpstreamTransport:
+    """
+    Configurable, warmed transport for Gemini API calls
+
+    Builds the generative/model service clients ourselves and installs them
+    as google-generativeai's default clients, so every GenerativeModel
+    shares them:
+
+      * 'rest': keep-alive requests sessions pooled to UPSTREAM_POOL_SIZE
+        (default: enough for every admitted request plus explain fan-out)
+      * 'grpc': one shared HTTP/2 channel with keepalive, multiplexing all calls
+
+    Connections are opened ahead of traffic (warm-up) and kept alive by a
+    background ping when the worker has been idle for UPSTREAM_KEEPALIVE_SECONDS,
+    so the first request after a quiet period does not pay DNS + TCP + TLS.
+    Clients and the ping thread are per process and rebuilt after a fork.
+
+    Installing the clients relies on google-generativeai internals (pinned
+    in requirements.txt). If they have moved, the transport logs it and
+    falls back to genai's default clients rather than failing requests.
+    """
+
+    def __init__(self, api_key: str, model_name: str):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.mode = os.getenv('UPSTREAM_TRANSPORT', 'rest')
+        # Optional host[:port] override, e.g. a proxy or a local stand-in
+        self.endpoint = os.getenv('UPSTREAM_ENDPOINT')
+        self.pool_size = int(os.getenv('UPSTREAM_POOL_SIZE') or upstream_pool_size(
+            int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 16)), int(os.getenv('EXPLAIN_MAX_WORKERS', 4))
+        ))
+        self.warm_connections = int(os.getenv('UPSTREAM_WARM_CONNECTIONS', 2))
+        self.keepalive_seconds = float(os.getenv('UPSTREAM_KEEPALIVE_SECONDS', 60))
+
+        self.lock = threading.Lock()
+        self.pid = None
+        self.clients = {}
+        self.fallback = False
+        self.last_used = 0.0
+        self.stats = {'warmups': 0, 'pings': 0, 'ping_failures': 0, 'requests': 0}
+
+        genai.configure(api_key=api_key, transport=self.mode)
+
+    def _build_clients(self) -> None:
+        """Create shared service clients and make them genai's defaults"""
+        client_manager = genai_client._client_manager
+        client_info = client_manager.client_config.get('client_info')
+
+        if self.mode == 'grpc':
+            if get_api_key_credentials is None:
+                raise ImportError('google.auth._default.get_api_key_credentials is unavailable')
+            # One HTTP/2 channel multiplexes every call; transport-level
+            # keepalive pings stop idle NATs/load balancers dropping it
+            channel = GenerativeServiceGrpcTransport.create_channel(
+                self.endpoint or GenerativeServiceGrpcTransport.DEFAULT_HOST,
+                credentials=get_api_key_credentials(self.api_key),
+                options=[
+                    ('grpc.keepalive_time_ms', int(max(self.keepalive_seconds, 10) * 1000)),
+                    ('grpc.keepalive_permit_without_calls', 1),
+                    ('grpc.http2.max_pings_without_data', 0),
+                ]
+            )
+            self.clients = {
+                'generative': glm.GenerativeServiceClient(
+                    transport=GenerativeServiceGrpcTransport(channel=channel, client_info=client_info)
+                ),
+                'model': glm.ModelServiceClient(
+                    transport=ModelServiceGrpcTransport(channel=channel, client_info=client_info)
+                ),
+            }
+        else:
+            options = {'api_key': self.api_key}
+            if self.endpoint:
+                options['api_endpoint'] = self.endpoint
+            self.clients = {
+                'generative': glm.GenerativeServiceClient(
+                    transport=self.mode, client_options=options, client_info=client_info
+                ),
+                'model': glm.ModelServiceClient(
+                    transport=self.mode, client_options=options, client_info=client_info
+                ),
+            }
+
+        if self.mode == 'rest':
+            # Both clients share one connection pool, so warm-up and pings on
+            # the model client keep the generation path warm. The pool is
+            # mounted on each client's existing session: the GAPIC transport
+            # keys its wrapped methods on that session object, so it must not
+            # be replaced.
+            shared = self.clients['generative']._transport._session
+            build_session(self.pool_size, shared)
+            build_session(self.pool_size, self.clients['model']._transport._session, shared.get_adapter('https://'))
+
+        # google-generativeai looks its default clients up by name
+        client_manager.clients.update(self.clients)
+
+    def _use_default_clients(self, error: Exception) -> None:
+        """Let google-generativeai build its own clients (no shared pool)"""
+        print(f"[UpstreamTransport] Cannot install shared clients ({type(error).__name__}: {error}); "
+              f"falling back to default clients")
+        self.clients = {}
+        self.fallback = True
+        options = {'api_endpoint': self.endpoint} if self.endpoint else None
+        try:
+            genai.configure(api_key=self.api_key, transport=self.mode, client_options=options)
+        except Exception as e:
+            # Keep whatever configuration __init__ installed
+            print(f"[UpstreamTransport] Reconfiguring default clients failed: {e}")
+
+    def start(self) -> None:
+        """Build clients, warm connections and start the keep-alive thread for this process"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            try:
+                self._build_clients()
+            except (AttributeError, ImportError, KeyError, TypeError) as e:
+                self._use_default_clients(e)
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.warm_up, name='upstream-warmup', daemon=True).start()
+        if self.keepalive_seconds > 0:
+            threading.Thread(target=self._keepalive_loop, name='upstream-keepalive', daemon=True).start()
+
+    def touch(self) -> None:
+        """Record upstream activity; lazily starts the transport in a fresh process"""
+        if self.pid != os.getpid():
+            self.start()
+        self.last_used = time.monotonic()
+        self.stats['requests'] += 1
+
+    def _ping(self) -> None:
+        """Cheap authenticated round trip (no tokens generated)"""
+        name = f"models/{self.model_name.split('/')[-1]}"
+        if self.fallback:
+            genai.get_model(name, request_options={'timeout': 10})
+            return
+        self.clients['model'].get_model(name=name, retry=None, timeout=10)
+
+    def warm_up(self) -> None:
+        """Open warm_connections connections in parallel"""
+        count = max(self.warm_connections if self.mode == 'rest' else 1, 1)
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                list(pool.map(lambda _: self._ping(), range(count)))
+            self.stats['warmups'] += 1
+            self.last_used = time.monotonic()
+            print(f"[UpstreamTransport] Warmed {count} {self.mode} connection(s) "
+                  f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"[UpstreamTransport] Warm-up failed: {e}")
+
+    def _keepalive_loop(self) -> None:
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(self.keepalive_seconds / 2)
+            if time.monotonic() - self.last_used < self.keepalive_seconds:
+                continue
+            try:
+                self._ping()
+                self.stats['pings'] += 1
+                self.last_used = time.monotonic()
+            except Exception as e:
+                self.stats['ping_failures'] += 1
+                print(f"[UpstreamTransport] Keep-alive ping failed: {e}")
+
+    def metrics(self) -> Dict:
+        metrics = {
+            'mode': self.mode,
+            'pool_size': self.pool_size,
+            'keepalive_seconds': self.keepalive_seconds,
+            'started': self.pid == os.getpid(),
+            'fallback': self.fallback,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+            **self.stats
+        }
+        if self.mode == 'rest' and self.pid == os.getpid() and not self.fallback:
+            try:
+                metrics['pools'] = pool_metrics(self.clients['generative']._transport._session)
+            except AttributeError:
+                metrics['pools'] = None
+        return metrics
@@ -1,3 +1,2 @@
 #!/bin/bash
-gunicorn --bind 0.0.0.0:8000 --workers 2 --timeout 120 app:app
-
+gunicorn -c gunicorn.conf.py
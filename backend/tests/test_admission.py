@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import AdmissionController, Rejected
+
+
+def controller(**kwargs):
+    options = {'max_in_flight': 4, 'max_queue': 12, 'target_ms': 10000, 'interval_ms': 10000}
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+def acquire_in_background(admission, priority_class):
+    """Start an acquire() on a thread; returns (thread, outcomes list)"""
+    outcomes = []
+
+    def run():
+        try:
+            admission.acquire(priority_class)
+            outcomes.append('admitted')
+        except Rejected as e:
+            outcomes.append(e.reason)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcomes
+
+
+def test_admits_up_to_class_limit():
+    admission = controller()
+    assert admission.acquire('bulk') == 0.0
+    assert admission.classes['bulk'].in_flight == 1
+
+    # bulk gets a quarter of the slots, so the next one has to queue
+    thread, outcomes = acquire_in_background(admission, 'bulk')
+    wait_until(lambda: admission.classes['bulk'].queued == 1)
+    admission.release('bulk', 0.1)
+    thread.join(2)
+    assert outcomes == ['admitted']
+
+
+def test_health_is_never_queued_or_counted():
+    admission = controller()
+    for _ in range(4):
+        admission.acquire('interactive')
+    assert admission.acquire('health') == 0.0
+    admission.release('health', 0.1)
+    assert admission.in_flight == 4
+
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    admission = controller()
+    for _ in range(4):
+        admission.acquire('interactive')
+
+    standard, standard_outcomes = acquire_in_background(admission, 'standard')
+    wait_until(lambda: admission.classes['standard'].queued == 1)
+    interactive, interactive_outcomes = acquire_in_background(admission, 'interactive')
+    wait_until(lambda: admission.classes['interactive'].queued == 1)
+
+    admission.release('interactive', 0.1)
+    interactive.join(2)
+    assert interactive_outcomes == ['admitted']
+    assert standard_outcomes == []
+
+    admission.release('interactive', 0.1)
+    standard.join(2)
+    assert standard_outcomes == ['admitted']
+
+
+def test_each_class_has_its_own_queue_cap():
+    admission = controller()
+    for _ in range(4):
+        admission.acquire('interactive')
+
+    # bulk's share of a 12-deep queue is 2
+    waiting = [acquire_in_background(admission, 'bulk') for _ in range(2)]
+    wait_until(lambda: admission.classes['bulk'].queued == 2)
+    with pytest.raises(Rejected, match='capacity'):
+        admission.acquire('bulk')
+
+    # A full bulk queue does not stop standard requests queueing
+    standard, outcomes = acquire_in_background(admission, 'standard')
+    wait_until(lambda: admission.classes['standard'].queued == 1)
+
+    for _ in range(4):
+        admission.release('interactive', 0.1)
+    standard.join(2)
+    assert outcomes == ['admitted']
+    for thread, _ in waiting:
+        admission.release('bulk', 0.1)
+        thread.join(2)
+
+
+def test_queue_deadline_rejects_and_counts_timeout():
+    admission = controller()
+    admission.classes['bulk'].max_wait = 0.05
+    admission.acquire('bulk')
+    with pytest.raises(Rejected, match='deadline'):
+        admission.acquire('bulk')
+    assert admission.classes['bulk'].timed_out == 1
+
+
+def test_shedding_rejects_new_arrivals_with_retry_after():
+    admission = controller()
+    state = admission.classes['bulk']
+    admission.acquire('bulk')
+    state.dropping = True
+    with pytest.raises(Rejected) as error:
+        admission.acquire('bulk')
+    assert error.value.reason == 'Server is shedding load'
+    assert error.value.retry_after >= 1
+
+
+def test_sustained_queue_delay_starts_shedding():
+    admission = controller(target_ms=10, interval_ms=10)
+    state = admission.classes['bulk']
+    now = time.monotonic()
+    admission._record_delay(state, 0.5, now)
+    assert not state.dropping
+    admission._record_delay(state, 0.5, now + 0.02)
+    assert state.dropping
+    admission._record_delay(state, 0.0, now + 0.03)
+    assert not state.dropping
+
+
+def test_dropping_last_waiter_ends_shedding():
+    admission = controller()
+    state = admission.classes['bulk']
+    admission.acquire('bulk')
+    thread, outcomes = acquire_in_background(admission, 'bulk')
+    wait_until(lambda: state.queued == 1)
+
+    # Shedding starts while the request waits; it is dropped at dequeue
+    admission.target = 0.0
+    state.dropping = True
+    state.drop_next = 0.0
+    admission.release('bulk', 0.1)
+    thread.join(2)
+
+    assert outcomes == ['Server is shedding load']
+    assert not state.dropping
+    assert admission.metrics()['classes']['bulk']['shedding'] is False
+
+
+def test_release_with_empty_queue_ends_shedding():
+    admission = controller()
+    state = admission.classes['standard']
+    admission.acquire('standard')
+    state.dropping = True
+    admission.release('standard', 0.2)
+    assert not state.dropping
+    assert admission.in_flight == 0
+
+
+def test_metrics_report_per_class_state():
+    admission = controller()
+    admission.acquire('standard')
+    metrics = admission.metrics()
+    assert metrics['in_flight'] == 1
+    assert metrics['classes']['standard']['in_flight'] == 1
+    assert metrics['classes']['bulk']['max_queue'] == 2
+    assert set(metrics['classes']) == {'health', 'interactive', 'standard', 'bulk'}
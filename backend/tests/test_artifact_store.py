@@ -0,0 +1,110 @@
+import itertools
+import time
+
+import pytest
+
+from services import artifact_store
+from services.artifact_store import ArtifactStore, artifact_hash
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / 'artifacts.db'), max_entries=1000)
+
+
+def put(store, prompt, output='out', kind='explain'):
+    return store.put(kind, 'model', prompt, {'language': 'python'}, output)
+
+
+def test_get_by_full_hash_and_prefix(store):
+    key = put(store, 'print(1)', 'prints one')
+    assert key == artifact_hash('explain', 'model', 'print(1)', {'language': 'python'})
+
+    artifact = store.get(key)
+    assert artifact['prompt'] == 'print(1)'
+    assert artifact['output'] == 'prints one'
+    assert store.get(key[:12])['hash'] == key
+    assert store.get('f' * 64 if key[0] != 'f' else '0' * 64) is None
+
+
+def test_ambiguous_prefix_raises(store):
+    keys = [put(store, f"prompt {number}") for number in range(40)]
+    # With 40 keys, some pair shares its first hex digit
+    first = [key[0] for key in keys]
+    shared = next(digit for digit in first if first.count(digit) > 1)
+    with pytest.raises(ValueError):
+        store.get(shared)
+
+
+def test_put_is_idempotent(store):
+    assert put(store, 'same') == put(store, 'same', 'different output')
+    assert store.stats()['kinds'] == {'explain': 1}
+
+
+def test_full_text_search(store):
+    if not store.fts_enabled:
+        pytest.skip('SQLite built without FTS5')
+    wanted = put(store, 'def fibonacci(n): ...', 'computes fibonacci numbers')
+    put(store, 'def factorial(n): ...', 'computes factorials')
+    put(store, 'SELECT fibonacci', 'a query', kind='generate')
+
+    assert [a['hash'] for a in store.search('fibonacci', kind='explain')] == [wanted]
+    assert [a['hash'] for a in store.search('fibonacci', prefix=wanted[:8])] == [wanted]
+    assert len(store.search('computes')) == 2
+    # FTS syntax in the query is treated as plain terms
+    assert store.search('fibonacci OR "') == []
+
+
+class TickingClock:
+    """time module stand-in whose wall clock advances one second per call"""
+
+    def __init__(self):
+        self.ticks = itertools.count(1)
+
+    def time(self):
+        return float(next(self.ticks))
+
+    def monotonic(self):
+        return time.monotonic()
+
+
+def test_compaction_evicts_least_recently_used(store, monkeypatch):
+    monkeypatch.setattr(artifact_store, 'time', TickingClock())
+    keys = [put(store, f"prompt {number}") for number in range(10)]
+    store.max_entries = 5
+
+    # Read-through hits on the oldest entries keep them alive
+    for number in (0, 1):
+        assert store.lookup_output('explain', 'model', f"prompt {number}", {'language': 'python'})
+
+    assert store.compact() == 5
+    remaining = {key for key in keys if store.get(key) is not None}
+    assert remaining == {keys[0], keys[1], keys[7], keys[8], keys[9]}
+
+
+def test_touches_are_buffered_until_flushed(store):
+    key = put(store, 'prompt')
+
+    store.touch(key)
+    assert key in store.touched
+    assert store.flush_touches() == 1
+    assert store.touched == {}
+    assert store.flush_touches() == 0
+
+
+def test_output_samples_are_returned_oldest_first(store):
+    for multiple in (1.0, 2.0, 3.0):
+        store.put_output_sample('explain', 'python', multiple)
+    assert store.output_samples(2) == [('explain', 'python', 2.0), ('explain', 'python', 3.0)]
+
+
+def test_connection_is_reopened_after_fork(store):
+    conn = store._connection()
+    assert store._connection() is conn
+
+    # A forked worker inherits the thread-local but must not share the handle
+    store.local.pid = -1
+    reopened = store._connection()
+    assert reopened is not conn
+    assert store._connection() is reopened
+    assert put(store, 'after fork')
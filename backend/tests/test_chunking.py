@@ -0,0 +1,78 @@
+from utils.chunking import MIN_CHUNK_FRACTION, split_code
+
+
+def python_functions(count, body_lines=3, edited=None):
+    functions = []
+    for index in range(count):
+        body = [f"    value = {index} + {line}" for line in range(body_lines)]
+        if index == edited:
+            body.append("    value += 1  # edited")
+        functions.append(f"def function_{index}(value):\n" + '\n'.join(body) + "\n    return value\n")
+    return "import os\nimport sys\n\n\n" + '\n\n'.join(functions)
+
+
+def test_empty_input():
+    assert split_code('') == []
+
+
+def test_small_input_is_one_chunk():
+    code = "def a():\n    return 1\n"
+    assert split_code(code, 'python') == [code.rstrip('\n')]
+
+
+def test_chunks_reproduce_source_lines():
+    code = "\n" + python_functions(60)
+    chunks = split_code(code, 'python', max_chars=800)
+    assert len(chunks) > 1
+    assert '\n'.join(chunks) == '\n'.join(code.splitlines())
+
+
+def test_chunks_respect_size_limit_and_minimum():
+    max_chars = 800
+    chunks = split_code(python_functions(80), 'python', max_chars=max_chars)
+    assert all(len(chunk) <= max_chars for chunk in chunks)
+    # No content-defined cut leaves a tiny chunk (imports, one statement)
+    assert all(len(chunk) >= max_chars // MIN_CHUNK_FRACTION for chunk in chunks)
+
+
+def test_chunks_start_at_top_level_boundaries():
+    chunks = split_code(python_functions(40), 'python', max_chars=600)
+    assert all(chunk.startswith(('def ', 'import ')) for chunk in chunks)
+
+
+def test_edit_only_changes_nearby_chunks():
+    before = split_code(python_functions(80), 'python', max_chars=800)
+    after = split_code(python_functions(80, edited=40), 'python', max_chars=800)
+    # Content-defined boundaries resynchronise after the edited function
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_oversized_class_is_split_per_method():
+    methods = '\n'.join(
+        f"    def method_{index}(self):\n" + ''.join(f"        x = {line}\n" for line in range(10)) + "        return x\n"
+        for index in range(30)
+    )
+    code = f"class Big:\n    \"\"\"Docstring\"\"\"\n\n{methods}"
+    chunks = split_code(code, 'python', max_chars=1000)
+    assert len(chunks) > 1
+    assert chunks[0].startswith('class Big:')
+    assert all(chunk.lstrip().startswith('def method_') for chunk in chunks[1:])
+
+
+def test_brace_language_splits_after_closed_blocks():
+    functions = [
+        f"function f{index}(x) {{\n" + ''.join(f"  x += {line};\n" for line in range(6)) + "  return x;\n}"
+        for index in range(40)
+    ]
+    code = '\n'.join(functions)
+    chunks = split_code(code, 'javascript', max_chars=600)
+    assert len(chunks) > 1
+    assert all(chunk.startswith('function ') and chunk.rstrip().endswith('}') for chunk in chunks)
+    assert '\n'.join(chunks) == code
+
+
+def test_invalid_python_falls_back_to_indentation():
+    code = '\n'.join(f"block{index}:\n  value = {index}\n  other = (" for index in range(80))
+    chunks = split_code(code, 'python', max_chars=400)
+    assert len(chunks) > 1
+    assert '\n'.join(chunks) == code
@@ -0,0 +1,94 @@
+import pytest
+
+from utils.output_budget import (
+    HEADROOM, MIN_SAMPLES, PRIORS, STOP_SEQUENCES, OutputBudgetPlanner, join_continuation
+)
+
+
+class FakeStore:
+    """Just the output-sample half of ArtifactStore"""
+
+    def __init__(self):
+        self.rows = []
+
+    def put_output_sample(self, kind, language, multiple):
+        self.rows.append((kind, language, multiple))
+
+    def output_samples(self, limit=10000):
+        return self.rows[-limit:]
+
+
+def test_join_drops_reopened_fence_inside_code_block():
+    text = "Here you go:\n```python\ndef f():\n    return 1\n"
+    part = "```python\ndef g():\n    return 2\n```\n"
+    assert join_continuation(text, part) == text + "def g():\n    return 2\n```\n"
+
+
+def test_join_keeps_fence_when_text_is_outside_code_block():
+    text = "```python\nx = 1\n```\nNext:\n"
+    part = "```python\ny = 2\n```\n"
+    assert join_continuation(text, part) == text + part
+
+
+def test_join_strips_repeated_overlap():
+    text = "The function iterates over every item in the"
+    part = "every item in the list and sums them."
+    assert join_continuation(text, part) == "The function iterates over every item in the list and sums them."
+
+
+def test_join_strips_short_overlap_only_when_it_repeats_last_line():
+    assert join_continuation("first line\nreturn", "return total\n") == "first line\nreturn total\n"
+    # 'in' is a short coincidental overlap, not a repeated unfinished line
+    assert join_continuation("for x in", "in range(3):") == "for x inin range(3):"
+
+
+def test_join_without_overlap_appends():
+    assert join_continuation("abc", "def") == "abcdef"
+    assert join_continuation("line\n", "\nmore") == "line\n\nmore"
+
+
+def test_plan_uses_cap_until_min_samples():
+    planner = OutputBudgetPlanner()
+    for _ in range(MIN_SAMPLES - 1):
+        planner.record('explain', 'python', 1000, 2048, 550, False)
+
+    plan = planner.plan('explain', 1000, 'python')
+    assert not plan['learned']
+    assert plan['max_output_tokens'] == PRIORS['explain'][2]
+
+    planner.record('explain', 'python', 1000, 2048, 550, False)
+    plan = planner.plan('explain', 1000, 'python')
+    assert plan['learned']
+    # Every answer was half the prior (500 + 0.6 * 1000)
+    assert plan['max_output_tokens'] == int(1100 * 0.5 * HEADROOM)
+    assert plan['expected'] == 550
+
+
+def test_plan_falls_back_to_all_languages_and_keeps_floor():
+    planner = OutputBudgetPlanner()
+    for _ in range(MIN_SAMPLES):
+        planner.record('explain-chunk', 'go', 0, 1024, 10, False)
+    plan = planner.plan('explain-chunk', 0, 'rust')
+    assert plan['learned']
+    assert plan['max_output_tokens'] == 256
+    assert plan['stop_sequences'] == STOP_SEQUENCES['explain-chunk']
+
+
+def test_truncated_samples_are_inflated():
+    planner = OutputBudgetPlanner()
+    planner.record('generate', 'python', 0, 900, 900, True)
+    planner.record('generate', 'python', 0, 900, 900, False)
+    assert list(planner.samples[('generate', 'python')]) == [pytest.approx(1.5), pytest.approx(1.0)]
+    assert planner.metrics()['generate']['truncated'] == 1
+
+
+def test_samples_persist_across_planners():
+    store = FakeStore()
+    first = OutputBudgetPlanner()
+    first.attach(store)
+    for _ in range(MIN_SAMPLES):
+        first.record('improve', 'python', 100, 3072, 160, False)
+
+    second = OutputBudgetPlanner()
+    second.attach(store)
+    assert second.plan('improve', 100, 'python')['learned']
@@ -0,0 +1,141 @@
+import pytest
+
+from utils.patching import PatchError, apply_patch, extract_diff, parse_unified_diff
+
+
+SOURCE = ''.join(f"line{number}\n" for number in range(1, 21))
+
+
+def lines(text):
+    return text.splitlines()
+
+
+def test_applies_exact_hunk():
+    diff = "--- a/code\n+++ b/code\n@@ -2,3 +2,3 @@\n line2\n-line3\n+LINE3\n line4\n"
+    assert lines(apply_patch(SOURCE, diff))[:4] == ['line1', 'line2', 'LINE3', 'line4']
+
+
+def test_hunk_header_drifted_from_real_position():
+    # Declared at line 2, context actually sits at line 12
+    diff = "@@ -2,3 +2,3 @@\n line11\n-line12\n+LINE12\n line13\n"
+    patched = lines(apply_patch(SOURCE, diff))
+    assert patched[11] == 'LINE12'
+    assert len(patched) == 20
+
+
+def test_hunk_header_past_end_of_file():
+    diff = "@@ -90,3 +90,3 @@\n line18\n-line19\n+LINE19\n line20\n"
+    assert lines(apply_patch(SOURCE, diff))[-2:] == ['LINE19', 'line20']
+
+
+def test_repeated_context_uses_occurrence_nearest_header():
+    source = "x\ny\nx\ny\nx\ny\n"
+    diff = "@@ -5,2 +5,2 @@\n x\n-y\n+z\n"
+    assert apply_patch(source, diff) == "x\ny\nx\ny\nx\nz\n"
+
+
+def test_pure_insertion_after_line():
+    diff = "@@ -3,0 +4,2 @@\n+new1\n+new2\n"
+    assert lines(apply_patch(SOURCE, diff))[:6] == ['line1', 'line2', 'line3', 'new1', 'new2', 'line4']
+
+
+def test_pure_insertion_at_top():
+    diff = "@@ -0,0 +1,1 @@\n+# header\n"
+    assert lines(apply_patch(SOURCE, diff))[:2] == ['# header', 'line1']
+
+
+def test_blank_context_line_without_leading_space():
+    source = "def a():\n    return 1\n\ndef b():\n    return 2\n"
+    # The blank context line has lost its ' ' prefix, as models often emit it
+    diff = "@@ -2,4 +2,4 @@\n     return 1\n\n def b():\n-    return 2\n+    return 3\n"
+    assert apply_patch(source, diff) == "def a():\n    return 1\n\ndef b():\n    return 3\n"
+
+
+def test_out_of_order_hunks():
+    diff = (
+        "@@ -15,3 +15,3 @@\n line14\n-line15\n+LINE15\n line16\n"
+        "@@ -3,3 +3,3 @@\n line2\n-line3\n+LINE3\n line4\n"
+    )
+    patched = lines(apply_patch(SOURCE, diff))
+    assert patched[2] == 'LINE3'
+    assert patched[14] == 'LINE15'
+    assert len(patched) == 20
+
+
+def test_drifted_headers_on_hunks_in_file_order():
+    # Both headers are wrong, but the hunks are listed top to bottom
+    diff = (
+        "@@ -10,3 +10,3 @@\n line2\n-line3\n+LINE3\n line4\n"
+        "@@ -2,3 +2,3 @@\n line14\n-line15\n+LINE15\n line16\n"
+    )
+    patched = lines(apply_patch(SOURCE, diff))
+    assert patched[2] == 'LINE3'
+    assert patched[14] == 'LINE15'
+    assert len(patched) == 20
+
+
+def test_overlapping_hunks_raise():
+    diff = (
+        "@@ -3,3 +3,3 @@\n line2\n-line3\n+LINE3\n line4\n"
+        "@@ -4,2 +4,2 @@\n-line4\n+LINE4\n line5\n"
+    )
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, diff)
+
+
+def test_context_ignores_trailing_whitespace_and_keeps_original_lines():
+    source = "a   \nb\nc\n"
+    diff = "@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+    assert apply_patch(source, diff) == "a   \nB\nc\n"
+
+
+def test_preserves_missing_trailing_newline():
+    diff = "@@ -1,2 +1,2 @@\n-a\n+A\n b\n\\ No newline at end of file\n"
+    assert apply_patch("a\nb", diff) == "A\nb"
+
+
+def test_added_line_that_looks_like_file_header():
+    diff = "@@ -1,2 +1,3 @@\n a\n+++ x\n b\n"
+    assert apply_patch("a\nb\n", diff) == "a\n++ x\nb\n"
+
+
+def test_removed_line_that_looks_like_file_header():
+    source = "SELECT 1;\n-- old comment\nSELECT 2;\n"
+    diff = "--- a/query.sql\n+++ b/query.sql\n@@ -1,3 +1,2 @@\n SELECT 1;\n--- old comment\n SELECT 2;\n"
+    assert apply_patch(source, diff) == "SELECT 1;\nSELECT 2;\n"
+
+
+def test_file_headers_after_a_complete_hunk():
+    diff = (
+        "--- a/code\n+++ b/code\n@@ -2,1 +2,1 @@\n-line2\n+LINE2\n"
+        "--- a/code\n+++ b/code\n@@ -5,1 +5,1 @@\n-line5\n+LINE5\n"
+    )
+    patched = lines(apply_patch(SOURCE, diff))
+    assert patched[1] == 'LINE2'
+    assert patched[4] == 'LINE5'
+
+
+def test_missing_context_raises():
+    diff = "@@ -1,2 +1,2 @@\n-nothing like this\n+x\n"
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, diff)
+
+
+def test_no_hunks_raises():
+    with pytest.raises(PatchError):
+        apply_patch(SOURCE, "just some prose\n")
+
+
+def test_unexpected_hunk_line_raises():
+    with pytest.raises(PatchError):
+        parse_unified_diff("@@ -1,1 +1,1 @@\n-line1\n*line1\n")
+
+
+def test_extract_diff_fenced_and_bare():
+    fenced = "PATCH:\n```diff\n@@ -1,1 +1,1 @@\n-a\n+b\n```\nCHANGES:\n- x"
+    assert extract_diff(fenced) == "@@ -1,1 +1,1 @@\n-a\n+b\n"
+
+    bare = "Here you go\n--- a/code\n+++ b/code\n@@ -1 +1 @@\n-a\n+b\n"
+    assert extract_diff(bare).startswith('--- a/code')
+
+    assert extract_diff("no diff here") == ''
@@ -0,0 +1,104 @@
+import os
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from utils.profiler import ProfilerControl, SamplingProfiler, SlowRequestLog
+from utils.tracing import Tracer
+
+
+def worker(directory):
+    """One gunicorn worker's profiler, slow-request log and control"""
+    return ProfilerControl(SamplingProfiler(max_seconds=30), SlowRequestLog(0, 10), str(directory), poll_seconds=0)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.01)
+
+
+@contextmanager
+def as_pid(pid):
+    """Act as another worker process (files are named by pid)"""
+    getpid = os.getpid
+    os.getpid = lambda: pid
+    try:
+        yield
+    finally:
+        os.getpid = getpid
+
+
+@pytest.fixture
+def workers(tmp_path):
+    pair = [worker(tmp_path), worker(tmp_path)]
+    yield pair
+    for control in pair:
+        control.profiler.stop()
+
+
+def test_profile_started_in_one_worker_runs_in_all(workers):
+    first, second = workers
+    first.publish('profile', action='start', interval_ms=1, seconds=10)
+    assert first.profiler.running
+    assert not second.profiler.running
+
+    with as_pid(1):
+        second.poll()
+    assert second.profiler.running
+    assert first.profile_running()
+    wait_until(lambda: first.profiler.samples and second.profiler.samples)
+
+    first.publish('profile', action='stop')
+    second.poll()
+    assert not first.profiler.running
+    assert not second.profiler.running
+    assert not first.profile_running()
+
+    collapsed, status = second.merged_profile()
+    assert status['samples'] == first.profiler.samples + second.profiler.samples > 0
+    assert not status['running']
+    assert 'test_profiler.py:wait_until' in collapsed
+
+
+def test_late_poll_only_profiles_rest_of_run(workers):
+    first, second = workers
+    first.publish('profile', action='start', interval_ms=1, seconds=0.05)
+    time.sleep(0.1)
+    second.poll()
+    assert not second.profiler.running
+
+
+def test_poll_is_throttled(tmp_path):
+    first = worker(tmp_path)
+    second = ProfilerControl(SamplingProfiler(), SlowRequestLog(0, 10), str(tmp_path), poll_seconds=60)
+    second.poll()
+    first.publish('slow_requests', threshold_ms=5, capacity=None)
+    second.poll()
+    assert not second.slow_log.enabled
+    second.poll(force=True)
+    assert second.slow_log.threshold_ms == 5
+
+
+def test_slow_requests_shared_and_cleared(workers):
+    first, second = workers
+    first.publish('slow_requests', threshold_ms=0.001, capacity=None)
+    second.poll()
+    assert first.slow_log.enabled and second.slow_log.enabled
+
+    tracer = Tracer(sample_rate=0)
+    for control, name, pid in ((first, 'GET /a', 1), (second, 'GET /b', 2)):
+        with tracer.start_trace(name, record=True) as root:
+            time.sleep(0.002)
+        with as_pid(pid):
+            control.slow_log.capture(root)
+
+    assert [entry['name'] for entry in first.merged_slow_requests()] == ['GET /b', 'GET /a']
+
+    second.clear_slow_requests()
+    first.poll()
+    assert first.merged_slow_requests() == []
+    assert list(first.slow_log.entries) == []
+    assert first.slow_log.enabled
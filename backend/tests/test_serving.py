@@ -0,0 +1,29 @@
+from utils.serving import admission_limits, recommend, upstream_pool_size
+
+
+def test_at_least_two_workers_on_small_containers():
+    assert recommend(cpus=0.5)['workers'] == 2
+    assert recommend(cpus=1)['workers'] == 2
+    assert recommend(cpus=4)['workers'] == 5
+
+
+def test_memory_can_force_a_single_worker():
+    profile = recommend(cpus=1, memory_mb=300)
+    assert profile['workers'] == 1
+    assert recommend(cpus=1, memory_mb=1024)['workers'] == 2
+
+
+def test_threads_follow_latency_ratio_until_capped():
+    default = recommend(cpus=2)
+    assert default['threads'] == 64
+    assert default['threads_capped']
+
+    fast = recommend(cpus=2, upstream_latency=0.1, cpu_ms_per_request=10)
+    assert fast['threads'] == 11
+    assert not fast['threads_capped']
+
+
+def test_admission_limits_leave_threads_for_health_probes():
+    limits = admission_limits(64)
+    assert limits['admission_max_in_flight'] + limits['admission_max_queue'] == 62
+    assert upstream_pool_size(limits['admission_max_in_flight'], 4) == limits['admission_max_in_flight'] + 5
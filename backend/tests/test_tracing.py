@@ -0,0 +1,98 @@
+import pytest
+
+from utils.tracing import NOOP_SPAN, Tracer, current_span
+
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    spans = []
+    monkeypatch.setattr(Tracer, 'export', lambda self, span: spans.append(span))
+    return spans
+
+
+def test_sampled_traceparent_continues_trace(exported):
+    tracer = Tracer(sample_rate=0)
+    with tracer.start_trace('GET /x', f"00-{TRACE_ID}-{PARENT_ID}-01") as root:
+        assert current_span.get() is root
+    assert root.trace_id == TRACE_ID
+    assert root.parent_id == PARENT_ID
+    assert root.sampled
+    assert root.traceparent == f"00-{TRACE_ID}-{root.span_id}-01"
+    assert exported == [root]
+    assert current_span.get() is None
+
+
+def test_traceparent_is_case_and_whitespace_tolerant():
+    tracer = Tracer(sample_rate=0)
+    root = tracer.start_trace('GET /x', f" 00-{TRACE_ID.upper()}-{PARENT_ID}-01 ")
+    assert root.trace_id == TRACE_ID
+
+
+def test_unsampled_traceparent_follows_sample_rate():
+    header = f"00-{TRACE_ID}-{PARENT_ID}-00"
+    assert Tracer(sample_rate=0).start_trace('GET /x', header) is NOOP_SPAN
+
+    root = Tracer(sample_rate=1).start_trace('GET /x', header)
+    assert root.trace_id == TRACE_ID
+    assert root.parent_id == PARENT_ID
+
+
+@pytest.mark.parametrize('header', [
+    'garbage',
+    f"01-{TRACE_ID}-{PARENT_ID}-01",
+    f"00-{TRACE_ID[:-1]}-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{PARENT_ID}-1",
+])
+def test_invalid_traceparent_starts_new_trace(header):
+    assert Tracer(sample_rate=0).start_trace('GET /x', header) is NOOP_SPAN
+
+    root = Tracer(sample_rate=1).start_trace('GET /x', header)
+    assert root.trace_id != TRACE_ID
+    assert len(root.trace_id) == 32
+    assert root.parent_id is None
+
+
+def test_child_spans_link_to_parent(exported):
+    tracer = Tracer(sample_rate=1)
+    with tracer.start_trace('GET /x') as root:
+        with tracer.span('db', table='t') as child:
+            with tracer.span('row') as grandchild:
+                pass
+        assert current_span.get() is root
+
+    assert child.trace_id == grandchild.trace_id == root.trace_id
+    assert child.parent_id == root.span_id
+    assert grandchild.parent_id == child.span_id
+    assert child.attributes == {'table': 't'}
+    assert [span.name for span in exported] == ['row', 'db', 'GET /x']
+
+
+def test_span_outside_trace_is_noop():
+    assert Tracer(sample_rate=1).span('orphan') is NOOP_SPAN
+
+
+def test_exception_marks_span_as_error(exported):
+    tracer = Tracer(sample_rate=1)
+    with pytest.raises(ValueError):
+        with tracer.start_trace('GET /x'):
+            with tracer.span('work'):
+                raise ValueError('bad input')
+    assert exported[0].status == 'ERROR'
+    assert exported[0].attributes['exception.message'] == 'bad input'
+    assert exported[1].status == 'ERROR'
+
+
+def test_recorded_unsampled_trace_is_not_exported(exported):
+    tracer = Tracer(sample_rate=0)
+    with tracer.start_trace('GET /x', record=True) as root:
+        with tracer.span('stage'):
+            pass
+
+    assert not root.sampled
+    assert [span.name for span in root.recorder] == ['stage', 'GET /x']
+    assert root.recorder[0].parent_id == root.span_id
+    assert exported == []
@@ -0,0 +1,31 @@
+import hmac
+import os
+from functools import wraps
+from flask import request, jsonify
+
+
+def admin_required(f):
+    """
+    Restrict an endpoint to callers presenting ADMIN_TOKEN
+
+    The token is sent in the X-Admin-Token header. When ADMIN_TOKEN is not
+    set the endpoint is disabled and answers 404.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = os.getenv('ADMIN_TOKEN')
+        if not token:
+            return jsonify({
+                'success': False,
+                'error': 'Not found'
+            }), 404
+
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return jsonify({
+                'success': False,
+                'error': 'Admin token required'
+            }), 403
+
+        return f(*args, **kwargs)
+    return decorated_function
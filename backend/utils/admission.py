@@ -0,0 +1,267 @@
+import heapq
+import itertools
+import math
+import os
+import time
+from threading import Condition
+from typing import Dict, Optional
+
+
+# Priority classes, highest priority first
+PRIORITY_CLASSES = ['health', 'interactive', 'standard', 'bulk']
+
+# Blueprint endpoint -> priority class (unlisted endpoints are 'interactive').
+# The app-level /health route sits outside the blueprint and is never queued.
+ENDPOINT_CLASSES = {
+    'api.chat': 'interactive',
+    'api.get_available_models': 'interactive',
+    'api.get_admission_metrics': 'health',
+    'api.get_upstream_metrics': 'health',
+    'api.get_budget_metrics': 'health',
+    'api.get_profile': 'health',
+    'api.control_profile': 'health',
+    'api.get_slow_requests': 'health',
+    'api.configure_slow_requests': 'health',
+    'api.clear_slow_requests': 'health',
+    'api.get_thread_dump': 'health',
+    'api.generate_code': 'standard',
+    'api.explain_code': 'standard',
+    'api.improve_code': 'bulk',
+}
+
+
+class Rejected(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClassState:
+    """Concurrency, queue and CoDel state for one priority class"""
+
+    def __init__(self, name: str, priority: int, limit: int, max_wait: float, max_queue: int = 0):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # CoDel: time at which queue delay first stayed above target, and
+        # whether we are currently shedding new arrivals
+        self.first_above_time = 0.0
+        self.dropping = False
+        self.drop_next = 0.0
+        self.drop_count = 0
+        self.service_time = 1.0  # EWMA of seconds a request holds its slot
+
+    def snapshot(self) -> Dict:
+        return {
+            'priority': self.priority,
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queued,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'shedding': self.dropping,
+            'avg_service_seconds': round(self.service_time, 3)
+        }
+
+
+class AdmissionController:
+    """
+    Priority admission control with CoDel-style load shedding
+
+    Requests take a slot from a shared in-flight budget and from their
+    class's own limit. When no slot is free they queue; freed slots always
+    go to the highest-priority waiter. Lower classes get smaller limits so
+    a burst of bulk work can never occupy every slot, and 'health' is never
+    queued or limited at all.
+
+    Shedding follows CoDel: if the queue delay seen by admitted requests
+    stays above target for a full interval, the class starts shedding: new
+    arrivals are rejected immediately (503 with Retry-After) instead of
+    queueing, and queued requests are dropped at an increasing rate, until
+    a request is again admitted under target or the queue drains.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        target_ms: Optional[float] = None,
+        interval_ms: Optional[float] = None,
+        max_queue: Optional[int] = None
+    ):
+        self.max_in_flight = max_in_flight or int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 16))
+        # Queued requests still hold a server thread, so the queue is capped
+        # too; in_flight + queue should stay below the worker's thread count
+        # to leave room for health probes. Each class gets its own share so
+        # a burst of one class cannot take every queue position.
+        self.max_queue = max_queue or int(os.getenv('ADMISSION_MAX_QUEUE', self.max_in_flight))
+        self.target = (target_ms or float(os.getenv('ADMISSION_TARGET_MS', 1000))) / 1000
+        self.interval = (interval_ms or float(os.getenv('ADMISSION_INTERVAL_MS', 5000))) / 1000
+
+        m = self.max_in_flight
+        q = self.max_queue
+        self.classes = {
+            'health': ClassState('health', 0, 0, 0),
+            'interactive': ClassState('interactive', 1, m, 10.0, max(q // 2, 1)),
+            'standard': ClassState('standard', 2, max(m * 3 // 4, 1), 15.0, max(q // 3, 1)),
+            'bulk': ClassState('bulk', 3, max(m // 4, 1), 5.0, max(q // 6, 1)),
+        }
+        self.in_flight = 0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+
+    def _has_capacity(self, state: ClassState) -> bool:
+        return self.in_flight < self.max_in_flight and state.in_flight < state.limit
+
+    def _blocked_by_waiters(self, state: ClassState) -> bool:
+        """True if anyone of equal or higher priority is already queued"""
+        return any(priority <= state.priority for priority, _, _ in self.waiters)
+
+    def _first_eligible(self):
+        """Sequence number of the highest-priority waiter that could run now"""
+        for priority, seq, name in sorted(self.waiters):
+            if self._has_capacity(self.classes[name]):
+                return seq
+        return None
+
+    def _retry_after(self, state: ClassState) -> int:
+        """Rough seconds until a slot frees up for this class"""
+        backlog = (state.queued + state.in_flight) / max(state.limit, 1)
+        return max(1, math.ceil(backlog * state.service_time))
+
+    @staticmethod
+    def _reset_codel(state: ClassState) -> None:
+        state.first_above_time = 0.0
+        state.dropping = False
+
+    def _record_delay(self, state: ClassState, delay: float, now: float) -> None:
+        """CoDel state update on every admission"""
+        if delay < self.target:
+            self._reset_codel(state)
+        elif state.first_above_time == 0.0:
+            state.first_above_time = now + self.interval
+        elif now >= state.first_above_time and not state.dropping:
+            state.dropping = True
+            state.drop_count = 0
+            state.drop_next = now
+
+    def acquire(self, priority_class: str) -> float:
+        """
+        Block until the request may run
+
+        Args:
+            priority_class: One of PRIORITY_CLASSES
+
+        Returns:
+            Seconds spent queued
+
+        Raises:
+            Rejected: If the request is shed or its queue deadline passes
+        """
+        state = self.classes[priority_class]
+        if state.name == 'health':
+            return 0.0
+
+        arrived = time.monotonic()
+        with self.condition:
+            if self._has_capacity(state) and not self._blocked_by_waiters(state):
+                self._record_delay(state, 0.0, arrived)
+                return self._admit(state, 0.0)
+
+            if state.dropping:
+                state.rejected += 1
+                raise Rejected('Server is shedding load', self._retry_after(state))
+
+            if state.queued >= state.max_queue:
+                state.rejected += 1
+                raise Rejected('Server is at capacity', self._retry_after(state))
+
+            entry = (state.priority, next(self.sequence), state.name)
+            heapq.heappush(self.waiters, entry)
+            state.queued += 1
+            deadline = arrived + state.max_wait
+
+            try:
+                while self._first_eligible() != entry[1]:
+                    now = time.monotonic()
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        state.timed_out += 1
+                        # Waiting this long means the queue is over target
+                        self._record_delay(state, now - arrived, now)
+                        raise Rejected('Queue wait deadline exceeded', self._retry_after(state))
+                    self.condition.wait(remaining)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                state.queued -= 1
+                # Someone else may now be first in line
+                self.condition.notify_all()
+
+            # CoDel drops at dequeue: once shedding, queued requests that
+            # waited past target are rejected at a rate that rises with
+            # interval / sqrt(drops) until the delay comes back under target
+            now = time.monotonic()
+            delay = now - arrived
+            self._record_delay(state, delay, now)
+            if state.dropping and now >= state.drop_next:
+                state.drop_count += 1
+                state.drop_next = now + self.interval / math.sqrt(state.drop_count)
+                state.rejected += 1
+                retry_after = self._retry_after(state)
+                if state.queued == 0:
+                    # Queue drained: no later admission or release would
+                    # otherwise end the shedding state
+                    self._reset_codel(state)
+                raise Rejected('Server is shedding load', retry_after)
+
+            return self._admit(state, delay)
+
+    def _admit(self, state: ClassState, delay: float) -> float:
+        state.in_flight += 1
+        state.admitted += 1
+        self.in_flight += 1
+        return delay
+
+    def release(self, priority_class: str, service_time: float) -> None:
+        """Return a slot taken by acquire()"""
+        state = self.classes[priority_class]
+        if state.name == 'health':
+            return
+
+        with self.condition:
+            state.in_flight -= 1
+            self.in_flight -= 1
+            state.service_time = 0.8 * state.service_time + 0.2 * service_time
+            if not self.waiters:
+                self._reset_codel(state)
+            self.condition.notify_all()
+
+    def metrics(self) -> Dict:
+        """Queue depth and admission counters per class"""
+        with self.condition:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'queue_depth': len(self.waiters),
+                'max_queue': self.max_queue,
+                'target_ms': self.target * 1000,
+                'interval_ms': self.interval * 1000,
+                'classes': {name: state.snapshot() for name, state in self.classes.items()}
+            }
+
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -0,0 +1,138 @@
+import ast
+import zlib
+from typing import List
+
+
+BRACE_LANGUAGES = {
+    'javascript', 'typescript', 'java', 'cpp', 'c', 'go', 'rust', 'php',
+    'csharp', 'kotlin', 'swift', 'scala'
+}
+
+# Average number of top-level units per chunk before a content-defined cut
+UNITS_PER_CHUNK = 4
+
+# Content-defined cuts only once a chunk has max_chars / MIN_CHUNK_FRACTION;
+# every chunk is a separate model call, so tiny chunks cost a round trip each
+MIN_CHUNK_FRACTION = 4
+
+
+def _node_start(node: ast.AST) -> int:
+    """First line (0-based) of a node, including any decorators"""
+    line = node.lineno
+    for decorator in getattr(node, 'decorator_list', []):
+        line = min(line, decorator.lineno)
+    return line - 1
+
+
+def _python_boundaries(code: str, lines: List[str], max_chars: int) -> List[int]:
+    """
+    Start lines (0-based) of each top-level statement
+
+    Classes too large for one chunk are opened up so each method becomes
+    its own unit.
+    """
+    tree = ast.parse(code)
+    starts = []
+    for node in tree.body:
+        starts.append(_node_start(node))
+        if isinstance(node, ast.ClassDef):
+            size = sum(len(line) + 1 for line in lines[node.lineno - 1:node.end_lineno])
+            if size > max_chars:
+                starts.extend(_node_start(child) for child in node.body[1:])
+    return starts
+
+
+def _brace_boundaries(lines: List[str]) -> List[int]:
+    """Lines where brace depth returns to zero, i.e. after a top-level block closes"""
+    starts = [0]
+    depth = 0
+    for index, line in enumerate(lines):
+        depth += line.count('{') - line.count('}')
+        if depth <= 0:
+            depth = 0
+            if '}' in line and index + 1 < len(lines):
+                starts.append(index + 1)
+    return starts
+
+
+def _indent_boundaries(lines: List[str]) -> List[int]:
+    """Unindented lines following an indented block (Ruby, YAML-ish, etc.)"""
+    starts = [0]
+    previous_indented = False
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        indented = line[0] in ' \t'
+        if not indented and previous_indented:
+            starts.append(index)
+        previous_indented = indented
+    return starts
+
+
+def split_code(code: str, language: str = 'auto', max_chars: int = 4000) -> List[str]:
+    """
+    Split code into chunks at syntactic boundaries
+
+    Uses the Python AST for Python, brace depth for C-like languages and
+    indentation otherwise. Adjacent small units are packed together up to
+    max_chars so a chunk is usually a handful of functions; a single unit
+    larger than max_chars is kept whole rather than cut mid-block.
+
+    Chunks also end after any unit whose checksum hits a fixed pattern, once
+    they are at least a quarter of max_chars, so boundaries are
+    content-defined: editing one function only changes the chunk containing
+    it instead of shifting every chunk after it, which keeps per-chunk
+    caches warm across edits. A small trailing chunk is merged into the one
+    before it when it fits.
+
+    Args:
+        code: Source code
+        language: Language hint ('auto' tries Python first)
+        max_chars: Soft size limit per chunk
+
+    Returns:
+        List of chunk strings, in source order
+    """
+    lines = code.splitlines()
+    if not lines:
+        return []
+
+    starts = None
+    if language in ('python', 'auto'):
+        try:
+            starts = _python_boundaries(code, lines, max_chars)
+        except SyntaxError:
+            starts = None
+    if starts is None:
+        if language in BRACE_LANGUAGES or (language == 'auto' and '{' in code):
+            starts = _brace_boundaries(lines)
+        else:
+            starts = _indent_boundaries(lines)
+
+    # Leading comments/imports before the first unit belong to the first chunk
+    starts = sorted(set([0] + [s for s in starts if 0 < s < len(lines)]))
+    units = [
+        '\n'.join(lines[start:end])
+        for start, end in zip(starts, starts[1:] + [len(lines)])
+    ]
+
+    min_chars = max_chars // MIN_CHUNK_FRACTION
+    chunks = []
+    current = None
+    for unit in units:
+        if current is not None and len(current) + len(unit) + 1 > max_chars:
+            chunks.append(current)
+            current = unit
+        else:
+            current = unit if current is None else f"{current}\n{unit}"
+
+        if len(current) >= min_chars and zlib.crc32(unit.encode('utf-8')) % UNITS_PER_CHUNK == 0:
+            chunks.append(current)
+            current = None
+    if current is not None:
+        if chunks and len(current) < min_chars and len(chunks[-1]) + len(current) + 1 <= max_chars:
+            chunks[-1] = f"{chunks[-1]}\n{current}"
+        else:
+            chunks.append(current)
+
+    return chunks
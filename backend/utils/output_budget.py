@@ -0,0 +1,214 @@
+import re
+from collections import defaultdict, deque
+import os
+from threading import Lock
+from typing import Dict, Optional
+
+
+# Per request type: (base tokens, output tokens per input token, hard cap).
+# base + ratio * input is the expected answer size, used for the prompt's
+# length hint. The caps are the old fixed max_output_tokens values and stay
+# the limit until enough real outputs have been seen.
+PRIORS = {
+    'generate': (900, 0.0, 4096),
+    'chat': (700, 0.3, 4096),
+    'explain': (500, 0.6, 2048),
+    'explain-chunk': (200, 0.5, 1024),
+    'explain-reduce': (400, 0.25, 2048),
+    'improve': (200, 1.2, 3072),
+    'improve-diff': (200, 0.5, 3072),
+}
+
+# Text the model tends to append after the useful part of the answer. A
+# stop sequence ends generation with finish_reason STOP, so a false match
+# silently cuts the answer short with no continuation: only markdown
+# headings are used, never plain words that can appear in code or prose.
+STOP_SEQUENCES = {
+    'generate': ['\n**Explanation', '\n### Explanation'],
+    'explain-chunk': ['\n--- Part'],
+    'improve-diff': ['\nBEST PRACTICES', '\n**Best Practices'],
+}
+
+FENCE = re.compile(r'^\s*```[\w+#.-]*[ \t]*(\n|$)')
+MIN_OVERLAP = 10
+MAX_OVERLAP = 2000
+
+# A learned limit needs this many samples and covers the 99th percentile
+# answer with headroom: a low limit never shortens an answer, it only
+# forces a slower continuation round trip
+MIN_SAMPLES = 50
+PERCENTILE = 0.99
+HEADROOM = 1.25
+MIN_TOKENS = 256
+
+
+def join_continuation(text: str, part: str) -> str:
+    """
+    Append a continuation to a truncated answer
+
+    Models resuming a cut-off answer often re-open the code block they were
+    inside, or repeat the last words they wrote. A leading fence is dropped
+    when the text so far ends inside a code block, and the longest prefix
+    of the continuation that the text already ends with is dropped. Short
+    overlaps only count when they repeat the whole unfinished last line.
+    """
+    open_fences = sum(1 for line in text.split('\n') if line.lstrip().startswith('```'))
+    if open_fences % 2 and FENCE.match(part):
+        part = part[FENCE.match(part).end():]
+
+    last_line = text[text.rfind('\n') + 1:]
+    for size in range(min(len(text), len(part), MAX_OVERLAP), 0, -1):
+        overlap = part[:size]
+        if not overlap.strip() or not text.endswith(overlap):
+            continue
+        if size >= MIN_OVERLAP or overlap == last_line:
+            part = part[size:]
+            break
+
+    return text + part
+
+
+class OutputBudgetPlanner:
+    """
+    Chooses max_output_tokens and a length hint per request
+
+    Each request type starts from a prior (base + ratio * input tokens).
+    Actual output sizes are recorded per (type, language) as a multiple of
+    that prior. The hint uses the median multiple; max_output_tokens stays
+    at the type's cap until MIN_SAMPLES outputs exist, and is then lowered
+    to the 99th percentile multiple plus headroom. Truncated answers are
+    recorded inflated so the limit grows quickly after a miss.
+
+    Samples are written to the artifact store when one is attached, so the
+    learned multiples survive worker recycling and each new worker starts
+    from the history of all workers.
+    """
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self.samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self.counters = defaultdict(lambda: {'requests': 0, 'truncated': 0, 'budget': 0, 'actual': 0})
+        self.lock = Lock()
+        self.store = None
+        self.pid = None
+
+    def attach(self, store) -> None:
+        """Persist samples in an artifact store; history is loaded lazily per process"""
+        self.store = store
+        self.pid = None
+
+    def _load(self) -> None:
+        """Reload history from the store once per process (workers fork from a preloaded master)"""
+        if self.store is None or self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        try:
+            samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+            for kind, language, multiple in self.store.output_samples(self.max_samples * 20):
+                samples[(kind, language)].append(multiple)
+                samples[(kind, '*')].append(multiple)
+            self.samples = samples
+        except Exception as e:
+            print(f"[OutputBudgetPlanner] Failed to load samples: {e}")
+
+    def _baseline(self, kind: str, input_tokens: int) -> float:
+        base, ratio, _ = PRIORS.get(kind, PRIORS['generate'])
+        return base + ratio * input_tokens
+
+    def _history(self, kind: str, language: str) -> Optional[list]:
+        """Sorted multiples for the most specific key with enough samples"""
+        for key in ((kind, language), (kind, '*')):
+            history = self.samples.get(key)
+            if history and len(history) >= MIN_SAMPLES:
+                return sorted(history)
+        return None
+
+    def plan(self, kind: str, input_tokens: int, language: str = 'auto', cap: Optional[int] = None) -> Dict:
+        """
+        Budget for one request
+
+        Args:
+            kind: Request type (a PRIORS key)
+            input_tokens: Estimated tokens of user-supplied input
+            language: Programming language hint
+            cap: Override for the request type's hard cap
+
+        Returns:
+            Dict with max_output_tokens, expected (tokens, for the length
+            hint), stop_sequences, cap and learned
+        """
+        cap = cap or PRIORS.get(kind, PRIORS['generate'])[2]
+        baseline = self._baseline(kind, input_tokens)
+        with self.lock:
+            self._load()
+            history = self._history(kind, language)
+
+        if history is None:
+            return {
+                'max_output_tokens': cap,
+                'expected': int(min(baseline, cap)),
+                'stop_sequences': STOP_SEQUENCES.get(kind, []),
+                'cap': cap,
+                'learned': False
+            }
+
+        tail = history[min(int(len(history) * PERCENTILE), len(history) - 1)]
+        return {
+            'max_output_tokens': max(MIN_TOKENS, min(int(baseline * tail * HEADROOM), cap)),
+            'expected': int(min(baseline * history[len(history) // 2], cap)),
+            'stop_sequences': STOP_SEQUENCES.get(kind, []),
+            'cap': cap,
+            'learned': True
+        }
+
+    def record(
+        self,
+        kind: str,
+        language: str,
+        input_tokens: int,
+        budget: int,
+        actual: int,
+        truncated: bool
+    ) -> None:
+        """Feed back the real output size of a finished request"""
+        multiple = actual / max(self._baseline(kind, input_tokens), 1)
+        if truncated:
+            multiple *= 1.5
+
+        with self.lock:
+            self._load()
+            self.samples[(kind, language)].append(multiple)
+            self.samples[(kind, '*')].append(multiple)
+            counters = self.counters[kind]
+            counters['requests'] += 1
+            counters['truncated'] += int(truncated)
+            counters['budget'] += budget
+            counters['actual'] += actual
+
+        if self.store is not None:
+            try:
+                self.store.put_output_sample(kind, language, multiple)
+            except Exception as e:
+                print(f"[OutputBudgetPlanner] Failed to persist sample: {e}")
+
+    def metrics(self) -> Dict:
+        """Budget vs actual totals (this worker) and the learned multiples per request type"""
+        with self.lock:
+            self._load()
+            metrics = {}
+            for kind in PRIORS:
+                counters = self.counters.get(kind, {'requests': 0, 'truncated': 0, 'budget': 0, 'actual': 0})
+                history = self._history(kind, '*')
+                metrics[kind] = {
+                    **counters,
+                    'truncation_rate': round(counters['truncated'] / max(counters['requests'], 1), 3),
+                    'budget_utilisation': round(counters['actual'] / max(counters['budget'], 1), 3),
+                    'samples': len(self.samples.get((kind, '*'), ())),
+                    'learned': history is not None,
+                    'median_multiple': round(history[len(history) // 2], 3) if history else None
+                }
+            return metrics
+
+
+# Global planner instance
+output_budget_planner = OutputBudgetPlanner()
@@ -0,0 +1,165 @@
+import re
+from typing import List, Tuple
+
+
+class PatchError(Exception):
+    """Raised when a unified diff cannot be parsed or applied"""
+
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def extract_diff(text: str) -> str:
+    """Pull the unified diff out of a model response (fenced or bare)"""
+    fenced = re.search(r'```(?:diff|patch)?\s*\n(.*?)```', text, re.DOTALL)
+    if fenced:
+        return fenced.group(1)
+
+    # Fall back to everything from the first hunk/file header onwards
+    match = re.search(r'^(---|@@)', text, re.MULTILINE)
+    return text[match.start():] if match else ''
+
+
+def parse_unified_diff(diff: str) -> List[Tuple[int, List[str]]]:
+    """
+    Parse a single-file unified diff into hunks
+
+    Args:
+        diff: Unified diff text
+
+    Returns:
+        List of (old_start, lines) tuples where each line keeps its
+        ' ', '-' or '+' prefix
+    """
+    hunks = []
+    current = None
+    # Lines the current hunk's header still expects on the old and new side
+    old_left = new_left = 0
+
+    for line in diff.splitlines():
+        # Inside a hunk, '--- x' is a removed '-- x' line and '+++ x' an added
+        # '++ x' line; they are file headers only once the hunk is complete
+        if (line.startswith('--- ') or line.startswith('+++ ')) and old_left <= 0 and new_left <= 0:
+            current = None
+            continue
+
+        header = HUNK_HEADER.match(line)
+        if header:
+            old_start = int(header.group(1))
+            if header.group(2) == '0':
+                # Pure insertion: the header names the line *before* the hunk
+                old_start += 1
+            old_left = int(header.group(2) or 1)
+            new_left = int(header.group(4) or 1)
+            current = (old_start, [])
+            hunks.append(current)
+            continue
+
+        if current is None:
+            continue
+
+        if line.startswith('\\'):
+            # "\ No newline at end of file"
+            continue
+
+        if line == '':
+            # Models often strip the single space on blank context lines
+            line = ' '
+        if line[0] in ' -+':
+            current[1].append(line)
+            old_left -= line[0] != '+'
+            new_left -= line[0] != '-'
+        else:
+            raise PatchError(f"Unexpected line in hunk: {line[:40]!r}")
+
+    if not hunks:
+        raise PatchError("No hunks found in diff")
+
+    return hunks
+
+
+def _find_hunk(lines: List[str], old: List[str], expected: int, floor: int) -> int:
+    """Locate hunk context in the file, searching outward from the expected line"""
+    if not old:
+        return max(expected, floor)
+
+    size = len(old)
+    last = len(lines) - size
+    expected = min(max(expected, floor), max(last, floor))
+
+    for offset in range(0, len(lines) + 1):
+        for candidate in (expected - offset, expected + offset):
+            if floor <= candidate <= last and lines[candidate:candidate + size] == old:
+                return candidate
+        if expected - offset < floor and expected + offset > last:
+            break
+
+    raise PatchError(f"Hunk context not found near line {expected + 1}")
+
+
+def apply_patch(source: str, diff: str) -> str:
+    """
+    Apply a unified diff to source text
+
+    Hunks are matched on exact context (ignoring trailing whitespace) and
+    may drift from their declared line numbers, as model-written headers
+    are frequently off by a few lines. Each hunk is located near its own
+    header, preferring a match after the previous hunk; hunks are then
+    applied in the order they were found in the file, so neither drifted
+    headers nor hunks emitted out of order break the patch. Hunks that
+    overlap are rejected.
+
+    Args:
+        source: Original file contents
+        diff: Unified diff against source
+
+    Returns:
+        Patched file contents
+
+    Raises:
+        PatchError: If the diff is malformed or does not apply cleanly
+    """
+    hunks = parse_unified_diff(diff)
+    original = source.splitlines()
+    stripped = [line.rstrip() for line in original]
+
+    located = []
+    floor = 0
+    for old_start, hunk_lines in hunks:
+        old = [line[1:].rstrip() for line in hunk_lines if line[0] in ' -']
+        expected = max(old_start - 1, 0)
+        try:
+            # A pure insertion has no context to search for; only its header
+            # says where it goes
+            position = _find_hunk(stripped, old, expected, floor if old else 0)
+        except PatchError:
+            # Models sometimes emit hunks out of order; look before the
+            # previous hunk too
+            position = _find_hunk(stripped, old, expected, 0)
+        located.append((position, len(old), hunk_lines))
+        floor = position + len(old)
+
+    # Apply top to bottom by where each hunk actually matched, not by its
+    # header, which is already known to be unreliable
+    located.sort(key=lambda hunk: (hunk[0], hunk[1]))
+    result = []
+    cursor = 0
+    for position, size, hunk_lines in located:
+        if position < cursor:
+            raise PatchError(f"Hunk at line {position + 1} overlaps the previous hunk")
+        result.extend(original[cursor:position])
+        # Context lines are copied from the source, so whitespace the model
+        # dropped from them is not lost
+        source_index = position
+        for line in hunk_lines:
+            if line[0] == '+':
+                result.append(line[1:])
+            else:
+                if line[0] == ' ':
+                    result.append(original[source_index])
+                source_index += 1
+        cursor = position + size
+
+    result.extend(original[cursor:])
+    patched = '\n'.join(result)
+    return patched + '\n' if source.endswith('\n') else patched
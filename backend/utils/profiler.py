@@ -0,0 +1,422 @@
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# How often a running profiler writes its stacks for other workers to read
+PROFILE_FLUSH_SECONDS = 1.0
+# A running profile whose file has not been refreshed for this long belongs
+# to a worker that has gone away
+PROFILE_STALE_SECONDS = 5.0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _write_json(path: Path, data) -> None:
+    """Replace a file atomically, so readers in other processes never see half of it"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_text(json.dumps(data))
+    os.replace(temporary, path)
+
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """One stack in flamegraph collapsed form: root;...;leaf"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ';'.join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for every thread in this process
+
+    While running, a background thread wakes every interval and counts the
+    current stack of each other thread. Threads blocked on locks, sleeping
+    in retry backoff or waiting on the upstream show up as well as threads
+    on the CPU. Output is the collapsed-stack format read by flamegraph.pl,
+    speedscope and inferno ("frame;frame;frame count" per line).
+
+    Nothing runs until start() is called, and a profile stops by itself
+    after PROFILE_MAX_SECONDS so it cannot be left on by accident.
+    """
+
+    def __init__(self, max_seconds: Optional[float] = None):
+        self.max_seconds = max_seconds or float(os.getenv('PROFILE_MAX_SECONDS', 300))
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = 0.01
+        self.started_at = None
+        self.stopped_at = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Where this worker shares its profile (set by ProfilerControl)
+        self.output_path = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval_ms: float = 10, seconds: Optional[float] = None) -> bool:
+        """
+        Start sampling, discarding any previous profile
+
+        Args:
+            interval_ms: Milliseconds between samples (min 1)
+            seconds: Stop automatically after this long (capped at max_seconds)
+
+        Returns:
+            False if a profile is already running
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = max(interval_ms, 1) / 1000
+            self.started_at = time.time()
+            self.stopped_at = None
+            self.stop_event = threading.Event()
+            duration = min(seconds or self.max_seconds, self.max_seconds)
+            self.thread = threading.Thread(
+                target=self._run, args=(self.stop_event, duration), name='sampling-profiler', daemon=True
+            )
+            self.thread.start()
+        print(f"[SamplingProfiler] Started ({interval_ms}ms interval, up to {duration:.0f}s)")
+        return True
+
+    def stop(self) -> None:
+        """Stop sampling; the collected profile is kept until the next start()"""
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, stop_event: threading.Event, duration: float) -> None:
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration
+        flushed_at = time.monotonic()
+        while not stop_event.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sample = [
+                collapse_stack(frame, names.get(ident, str(ident)))
+                for ident, frame in sys._current_frames().items() if ident != me
+            ]
+            with self.lock:
+                self.stacks.update(sample)
+                self.samples += 1
+            if time.monotonic() - flushed_at >= PROFILE_FLUSH_SECONDS:
+                self._save(running=True)
+                flushed_at = time.monotonic()
+        self.stopped_at = time.time()
+        self._save(running=False)
+        print(f"[SamplingProfiler] Stopped after {self.samples} samples")
+
+    def _save(self, running: bool) -> None:
+        path = self.output_path
+        if path is None:
+            return
+        with self.lock:
+            stacks = dict(self.stacks)
+            samples = self.samples
+        try:
+            _write_json(path, {
+                'pid': os.getpid(),
+                'running': running,
+                'samples': samples,
+                'updated_at': time.time(),
+                'stacks': stacks
+            })
+        except OSError as e:
+            print(f"[SamplingProfiler] Could not write {path}: {e}")
+
+    def collapsed(self) -> str:
+        """Profile so far, one 'stack count' line per distinct stack"""
+        with self.lock:
+            stacks = list(self.stacks.items())
+        return '\n'.join(f"{stack} {count}" for stack, count in sorted(stacks)) + '\n'
+
+    def status(self) -> Dict:
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'distinct_stacks': len(self.stacks),
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'pid': os.getpid()
+        }
+
+
+class SlowRequestLog:
+    """
+    Ring buffer of stage timings for requests slower than a threshold
+
+    While enabled, every request records its spans in memory (see
+    Tracer.start_trace(record=True)); when the request ends, the span tree
+    is kept only if the request took at least threshold_ms. With
+    SLOW_REQUEST_MS unset or 0 nothing is recorded.
+    """
+
+    def __init__(self, threshold_ms: Optional[float] = None, capacity: Optional[int] = None):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.getenv('SLOW_REQUEST_MS', 0))
+        self.entries = deque(maxlen=capacity or int(os.getenv('SLOW_REQUEST_BUFFER', 100)))
+        self.captured = 0
+        # Directory this worker shares its captures in (set by ProfilerControl)
+        self.share_dir = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def configure(self, threshold_ms: float, capacity: Optional[int] = None) -> None:
+        """Change the threshold (0 disables capture) and optionally the buffer size"""
+        self.threshold_ms = max(threshold_ms, 0)
+        if capacity and capacity != self.entries.maxlen:
+            self.entries = deque(self.entries, maxlen=capacity)
+
+    def capture(self, root) -> None:
+        """Keep a finished request's span tree if it was slow"""
+        if root.recorder is None or root.end_ns is None:
+            return
+        duration_ms = (root.end_ns - root.start_ns) / 1e6
+        if duration_ms < self.threshold_ms:
+            return
+
+        stages = []
+        for span in sorted(root.recorder, key=lambda s: s.start_ns):
+            stages.append({
+                'name': span.name,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id or '',
+                'offsetMs': round((span.start_ns - root.start_ns) / 1e6, 3),
+                'durationMs': round((span.end_ns - span.start_ns) / 1e6, 3),
+                'attributes': span.attributes,
+                'status': span.status
+            })
+        self.entries.append({
+            'traceId': root.trace_id,
+            'name': root.name,
+            'durationMs': round(duration_ms, 3),
+            'startTimeUnixNano': root.start_ns,
+            'statusCode': root.attributes.get('http.status_code'),
+            'pid': os.getpid(),
+            'stages': stages
+        })
+        self.captured += 1
+        if self.share_dir is not None:
+            path = self.share_dir / f"slow-{os.getpid()}.json"
+            try:
+                _write_json(path, list(self.entries))
+            except OSError as e:
+                print(f"[SlowRequestLog] Could not write {path}: {e}")
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        """Most recent slow requests first"""
+        return list(self.entries)[::-1][:limit]
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+def thread_dump() -> List[Dict]:
+    """Name, state and current stack of every thread in this process"""
+    frames = sys._current_frames()
+    threads = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        threads.append({
+            'name': thread.name,
+            'ident': thread.ident,
+            'daemon': thread.daemon,
+            'stack': [line.rstrip() for line in traceback.format_stack(frame)] if frame else []
+        })
+    return threads
+
+
+class ProfilerControl:
+    """
+    Profiler and slow-request settings shared by every gunicorn worker
+
+    An admin request only reaches one worker, so instead of changing that
+    worker alone the admin endpoints publish the desired state to a small
+    JSON control file. Each worker polls it from a request hook, at most
+    once per poll interval and only re-reading it when its mtime changes,
+    and applies new settings to its own profiler and slow-request log.
+    Workers write their profiles and slow requests next to the control
+    file, so reads can merge all of them.
+    """
+
+    def __init__(self, profiler: SamplingProfiler, slow_log: SlowRequestLog,
+                 directory: Optional[str] = None, poll_seconds: Optional[float] = None):
+        self.profiler = profiler
+        self.slow_log = slow_log
+        self.directory = Path(directory or os.getenv('PROFILER_DIR', str(BASE_DIR / 'data' / 'profiler')))
+        self.poll_seconds = poll_seconds if poll_seconds is not None else float(
+            os.getenv('PROFILER_POLL_SECONDS', 1)
+        )
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.mtime = None
+        self.applied = {'profile': 0, 'slow_requests': 0}
+        slow_log.share_dir = self.directory
+
+    @property
+    def control_path(self) -> Path:
+        return self.directory / 'control.json'
+
+    def _profile_path(self, run: int, pid: int) -> Path:
+        return self.directory / f"profile-{run}-{pid}.json"
+
+    def control(self) -> Dict:
+        """The current shared settings"""
+        return _read_json(self.control_path) or {}
+
+    def publish(self, section: str, **settings) -> Dict:
+        """
+        Publish new settings for every worker and apply them here at once
+
+        Args:
+            section: 'profile' or 'slow_requests'
+            settings: Replacement settings for the section
+
+        Returns:
+            The published section, with its new version
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        starting = section == 'profile' and settings.get('action') == 'start'
+        with self.lock:
+            control = self.control()
+            previous = control.get(section, {})
+            version = previous.get('version', 0) + 1
+            control[section] = dict(settings, version=version, published_at=time.time())
+            if section == 'profile':
+                # Workers' profile files are named after the run that started them
+                control[section]['run'] = version if starting else previous.get('run', 0)
+            _write_json(self.control_path, control)
+        if starting:
+            # Profiles of earlier runs are no longer served
+            for path in self.directory.glob('profile-*.json'):
+                path.unlink(missing_ok=True)
+        self.poll(force=True)
+        return control[section]
+
+    def poll(self, force: bool = False) -> None:
+        """Apply settings published since the last poll (cheap enough for every request)"""
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.poll_seconds:
+            return
+        self.checked_at = now
+        try:
+            mtime = self.control_path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.mtime and not force:
+            return
+
+        with self.lock:
+            self.mtime = mtime
+            control = self.control()
+            profile = control.get('profile')
+            if profile and profile['version'] > self.applied['profile']:
+                self.applied['profile'] = profile['version']
+                self._apply_profile(profile)
+            slow = control.get('slow_requests')
+            if slow and slow['version'] > self.applied['slow_requests']:
+                self.applied['slow_requests'] = slow['version']
+                self._apply_slow_requests(slow)
+
+    def _apply_profile(self, profile: Dict) -> None:
+        self.profiler.stop()
+        if profile.get('action') != 'start':
+            return
+        seconds = min(profile.get('seconds') or self.profiler.max_seconds, self.profiler.max_seconds)
+        # A worker that polls late only profiles what is left of the run
+        remaining = seconds - (time.time() - profile['published_at'])
+        if remaining > 0:
+            self.profiler.output_path = self._profile_path(profile['run'], os.getpid())
+            self.profiler.start(profile.get('interval_ms', 10), remaining)
+
+    def _apply_slow_requests(self, slow: Dict) -> None:
+        self.slow_log.configure(slow['threshold_ms'], slow.get('capacity'))
+        if slow.get('clear'):
+            self.slow_log.clear()
+
+    def profile_running(self) -> bool:
+        """Whether the last published profile is still within its duration"""
+        profile = self.control().get('profile', {})
+        if profile.get('action') != 'start':
+            return False
+        seconds = min(profile.get('seconds') or self.profiler.max_seconds, self.profiler.max_seconds)
+        return time.time() - profile['published_at'] < seconds
+
+    def merged_profile(self) -> Tuple[str, Dict]:
+        """
+        Collapsed stacks of the current profile summed over all workers
+
+        Returns:
+            (collapsed text, status with samples, running and worker pids)
+        """
+        run = self.control().get('profile', {}).get('run', 0)
+        stacks = Counter()
+        samples = 0
+        running = False
+        pids = []
+        for path in self.directory.glob(f"profile-{run}-*.json"):
+            data = _read_json(path)
+            if not data:
+                continue
+            stacks.update(data['stacks'])
+            samples += data['samples']
+            running |= data['running'] and time.time() - data['updated_at'] < PROFILE_STALE_SECONDS
+            pids.append(data['pid'])
+        text = '\n'.join(f"{stack} {count}" for stack, count in sorted(stacks.items())) + '\n'
+        return text, {'samples': samples, 'running': running, 'workers': sorted(pids)}
+
+    def merged_slow_requests(self, limit: int = 20) -> List[Dict]:
+        """Slow requests captured by any worker, most recent first"""
+        entries = []
+        for path in self.directory.glob('slow-*.json'):
+            entries.extend(_read_json(path) or [])
+        entries.sort(key=lambda entry: entry['startTimeUnixNano'], reverse=True)
+        return entries[:limit]
+
+    def clear_slow_requests(self) -> None:
+        """Empty every worker's slow-request buffer"""
+        for path in self.directory.glob('slow-*.json'):
+            path.unlink(missing_ok=True)
+        slow = self.control().get('slow_requests', {})
+        self.publish(
+            'slow_requests',
+            threshold_ms=slow.get('threshold_ms', self.slow_log.threshold_ms),
+            capacity=slow.get('capacity'),
+            clear=True
+        )
+
+
+# Global profiler, slow-request log and cross-worker control instances
+sampling_profiler = SamplingProfiler()
+slow_request_log = SlowRequestLog()
+profiler_control = ProfilerControl(sampling_profiler, slow_request_log)
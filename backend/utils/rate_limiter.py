@@ -1,8 +1,9 @@
 from functools import wraps
-from flask import request, jsonify
+from flask import current_app, g, request, jsonify
 import time
 from collections import defaultdict
 from threading import Lock
+from utils.tracing import tracer
 
 class RateLimiter:
     """Simple in-memory rate limiter"""
@@ -23,22 +24,27 @@ class RateLimiter:
         Returns:
             True if request is allowed, False otherwise
         """
-        with self.lock:
-            current_time = time.time()
-            
-            # Remove old entries outside the time window
-            self.requests[key] = [
-                req_time for req_time in self.requests[key]
-                if current_time - req_time < window_seconds
-            ]
-            
-            # Check if limit exceeded
-            if len(self.requests[key]) >= max_requests:
-                return False
-            
-            # Add current request
-            self.requests[key].append(current_time)
-            return True
+        with tracer.span('rate_limit.check', key=key, max_requests=max_requests) as span:
+            wait_start = time.perf_counter()
+            with self.lock:
+                span.set_attribute('lock_wait_ms', round((time.perf_counter() - wait_start) * 1000, 3))
+                current_time = time.time()
+                
+                # Remove old entries outside the time window
+                self.requests[key] = [
+                    req_time for req_time in self.requests[key]
+                    if current_time - req_time < window_seconds
+                ]
+                
+                # Check if limit exceeded
+                if len(self.requests[key]) >= max_requests:
+                    span.set_attribute('allowed', False)
+                    return False
+                
+                # Add current request
+                self.requests[key].append(current_time)
+                span.set_attribute('allowed', True)
+                return True
 
 # Global rate limiter instance
 rate_limiter = RateLimiter()
@@ -54,15 +60,42 @@ def rate_limit(max_requests: int = 10, window_seconds: int = 60):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Use IP address as key
-            key = request.remote_addr
-            
-            if not rate_limiter.is_allowed(key, max_requests, window_seconds):
-                return jsonify({
-                    'success': False,
-                    'error': f'Rate limit exceeded. Maximum {max_requests} requests per {window_seconds} seconds.'
-                }), 429
+            # Already checked if enforce_rate_limit() ran before admission
+            if not g.get('rate_limit_checked'):
+                rejected = check_rate_limit(max_requests, window_seconds)
+                if rejected is not None:
+                    return rejected
             
             return f(*args, **kwargs)
+        decorated_function.rate_limit = (max_requests, window_seconds)
         return decorated_function
     return decorator
+
+
+def check_rate_limit(max_requests: int, window_seconds: int):
+    """Return a 429 response if the caller's IP is over the limit, else None"""
+    # Use IP address as key
+    key = request.remote_addr
+    
+    if not rate_limiter.is_allowed(key, max_requests, window_seconds):
+        return jsonify({
+            'success': False,
+            'error': f'Rate limit exceeded. Maximum {max_requests} requests per {window_seconds} seconds.'
+        }), 429
+    return None
+
+
+def enforce_rate_limit():
+    """
+    Apply the current view's @rate_limit ahead of the view itself
+    
+    Used as a before_request hook so clients over their limit are turned
+    away before they take an admission slot or queue position.
+    """
+    view = current_app.view_functions.get(request.endpoint)
+    limits = getattr(view, 'rate_limit', None)
+    if limits is None or request.method == 'OPTIONS':
+        return None
+    
+    g.rate_limit_checked = True
+    return check_rate_limit(*limits)
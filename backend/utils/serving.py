@@ -0,0 +1,134 @@
+import math
+import os
+from typing import Dict, Optional
+
+
+def available_cpus() -> float:
+    """
+    CPUs actually available to this container
+
+    Honours the cgroup CPU quota (Docker --cpus, Azure plan limits) rather
+    than the host core count that os.cpu_count() reports.
+    """
+    try:
+        quota, period = open('/sys/fs/cgroup/cpu.max').read().split()
+        if quota != 'max':
+            return max(int(quota) / int(period), 0.25)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        quota = int(open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us').read())
+        period = int(open('/sys/fs/cgroup/cpu/cpu.cfs_period_us').read())
+        if quota > 0:
+            return max(quota / period, 0.25)
+    except (OSError, ValueError):
+        pass
+
+    if hasattr(os, 'sched_getaffinity'):
+        return float(len(os.sched_getaffinity(0)))
+    return float(os.cpu_count() or 1)
+
+
+def available_memory_mb() -> Optional[float]:
+    """Container memory limit in MB, or None if unlimited/unknown"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            value = open(path).read().strip()
+            if value != 'max' and int(value) < 1 << 60:
+                return int(value) / (1024 * 1024)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def admission_limits(threads: int) -> Dict:
+    """
+    Admission limits that fit inside one worker's thread pool
+
+    Two threads stay free for health probes; of the rest, two thirds may
+    run and one third may wait in the admission queue.
+    """
+    usable = max(threads - 2, 2)
+    max_in_flight = max(1, usable * 2 // 3)
+    return {
+        'admission_max_in_flight': max_in_flight,
+        'admission_max_queue': max(1, usable - max_in_flight)
+    }
+
+
+def upstream_pool_size(max_in_flight: int, explain_workers: int) -> int:
+    """
+    Keep-alive connections one worker needs to the model API
+
+    Every admitted request makes at most one upstream call at a time on its
+    own thread, chunked explanations add up to explain_workers calls from
+    the shared pool, and one more covers keep-alive pings.
+    """
+    return max_in_flight + explain_workers + 1
+
+
+def recommend(
+    cpus: float,
+    memory_mb: Optional[float] = None,
+    upstream_latency: float = 8.0,
+    cpu_ms_per_request: float = 15.0,
+    worker_memory_mb: float = 120.0,
+    thread_memory_mb: float = 2.0,
+    max_threads: int = 64
+) -> Dict:
+    """
+    Recommend gunicorn workers/threads for an I/O-bound deployment
+
+    Each request spends cpu_ms_per_request on the CPU and upstream_latency
+    waiting on the model. One worker process can keep one core busy with
+    1 + wait/compute threads, so threads are sized from that ratio, capped
+    at max_threads since the GIL and upstream rate limits make very large
+    pools useless. With the default 8s / 15ms the ratio is over 500, so the
+    cap is what actually sets the thread count (threads_capped is True);
+    the ratio only matters for upstream calls faster than about one second.
+
+    Workers follow the CPU count, with at least two so that a worker being
+    recycled (max_requests) or stuck never leaves nothing serving health
+    probes. Memory can still force a single worker.
+
+    Args:
+        cpus: CPUs available to the container
+        memory_mb: Container memory limit (None = unbounded)
+        upstream_latency: Expected seconds per upstream model call
+        cpu_ms_per_request: CPU milliseconds the app spends per request
+        worker_memory_mb: Resident memory of one worker (before sharing)
+        thread_memory_mb: Extra memory per thread
+        max_threads: Upper bound on threads per worker
+
+    Returns:
+        Dict with workers, threads (and whether max_threads capped them),
+        admission limits and expected capacity
+    """
+    workers = max(2, math.ceil(cpus))
+    if cpus >= 2:
+        workers = int(cpus) + 1
+
+    ratio = (upstream_latency * 1000) / max(cpu_ms_per_request, 0.1)
+    wanted_threads = max(4, math.ceil(1 + ratio))
+    threads = int(min(wanted_threads, max_threads))
+
+    if memory_mb:
+        # Keep 25% headroom for the master, page cache and spikes
+        budget = memory_mb * 0.75
+        per_worker = worker_memory_mb + threads * thread_memory_mb
+        workers = max(1, min(workers, int(budget // per_worker)))
+
+    limits = admission_limits(threads)
+    concurrency = workers * limits['admission_max_in_flight']
+    cpu_bound_rps = cpus * 1000 / max(cpu_ms_per_request, 0.1)
+    io_bound_rps = concurrency / max(upstream_latency, 0.001)
+
+    return {
+        'workers': workers,
+        'threads': threads,
+        'threads_capped': wanted_threads > threads,
+        **limits,
+        'max_concurrent_requests': concurrency,
+        'expected_max_rps': round(min(cpu_bound_rps, io_bound_rps), 2)
+    }
@@ -0,0 +1,193 @@
+import json
+import os
+import random
+import re
+import sys
+import time
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Optional
+
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Span:
+    """
+    A timed operation within a trace
+
+    Serialises to the OpenTelemetry span JSON shape (traceId, spanId,
+    parentSpanId, start/end in unix nanoseconds, attributes, status) so the
+    exported file can be loaded by OTLP-aware tooling.
+
+    A span with a recorder list also appends itself there when it ends, so
+    a whole request's spans can be inspected afterwards; unsampled spans
+    are only recorded, never exported.
+    """
+
+    def __init__(
+        self,
+        tracer,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict,
+        sampled: bool = True,
+        recorder: Optional[list] = None
+    ):
+        self.tracer = tracer
+        self.sampled = sampled
+        self.recorder = recorder
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = 'OK'
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, error: Exception) -> None:
+        self.status = 'ERROR'
+        self.attributes['exception.type'] = type(error).__name__
+        self.attributes['exception.message'] = str(error)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.recorder is not None:
+                self.recorder.append(self)
+            if self.sampled:
+                self.tracer.export(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'durationMs': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': {'code': self.status}
+        }
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.record_exception(exc)
+        current_span.reset(self.token)
+        self.end()
+        return False
+
+
+class NoopSpan:
+    """Shared do-nothing span used whenever the current request is not sampled"""
+
+    sampled = False
+    recorder = None
+    traceparent = None
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def record_exception(self, error: Exception) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+current_span: ContextVar = ContextVar('current_span', default=None)
+
+
+class Tracer:
+    """
+    Lightweight tracer with console and JSON-lines file exporters
+
+    Configured from the environment:
+        TRACE_SAMPLE_RATE: fraction of requests traced (default 0, off)
+        TRACE_EXPORTER: 'file' (default) or 'console'
+        TRACE_FILE: output path for the file exporter (default traces.jsonl)
+
+    A request carrying a W3C traceparent header with the sampled flag set
+    is always traced, so the frontend can force tracing of one call. When a
+    request is not sampled every span() call returns a shared no-op span
+    after a single context-variable lookup.
+    """
+
+    def __init__(self, sample_rate: Optional[float] = None, exporter: Optional[str] = None):
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('TRACE_SAMPLE_RATE', 0))
+        self.exporter = exporter or os.getenv('TRACE_EXPORTER', 'file')
+        self.path = os.getenv('TRACE_FILE', 'traces.jsonl')
+        self.lock = Lock()
+        self.file = None
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, record: bool = False, **attributes):
+        """
+        Start a root span for an incoming request
+
+        Args:
+            name: Span name (usually the route)
+            traceparent: Incoming W3C traceparent header, if any
+            record: Collect the request's spans in root.recorder even if unsampled
+            **attributes: Initial span attributes
+
+        Returns:
+            A Span if the request is sampled or recorded, otherwise NOOP_SPAN
+        """
+        parent = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+
+        if parent:
+            trace_id, parent_id, flags = parent.groups()
+            sampled = bool(int(flags, 16) & 1) or random.random() < self.sample_rate
+        else:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+            trace_id, parent_id = None, None
+
+        if not sampled and not record:
+            return NOOP_SPAN
+        trace_id = trace_id or '%032x' % random.getrandbits(128)
+        return Span(self, name, trace_id, parent_id, attributes, sampled, [] if record else None)
+
+    def span(self, name: str, **attributes):
+        """Child span of the current span; a no-op when nothing is being traced"""
+        parent = current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes, parent.sampled, parent.recorder)
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            if self.exporter == 'console':
+                print(f"[trace] {line}", file=sys.stderr)
+            else:
+                if self.file is None:
+                    # Kept open and line-buffered; O_APPEND keeps lines from
+                    # several workers intact
+                    self.file = open(self.path, 'a', buffering=1)
+                self.file.write(line + '\n')
+
+
+# Global tracer instance
+tracer = Tracer()
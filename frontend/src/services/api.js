@@ -11,10 +11,27 @@ const apiClient = axios.create({
   },
 });
 
+const TRACE_SAMPLE_RATE = parseFloat(process.env.REACT_APP_TRACE_SAMPLE_RATE || '0');
+
+function randomHex(bytes) {
+  const values = new Uint8Array(bytes);
+  window.crypto.getRandomValues(values);
+  return Array.from(values, (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * Build a W3C traceparent header; the sampled flag asks the backend to trace this call
+ */
+function createTraceparent() {
+  const sampled = Math.random() < TRACE_SAMPLE_RATE ? '01' : '00';
+  return `00-${randomHex(16)}-${randomHex(8)}-${sampled}`;
+}
+
 // Request interceptor
 apiClient.interceptors.request.use(
   (config) => {
     // Add any auth tokens here if needed
+    config.headers.traceparent = createTraceparent();
     return config;
   },
   (error) => {
@@ -90,12 +107,13 @@ export async function explainCode(code, language = 'auto') {
 /**
  * Improve existing code
  */
-export async function improveCode(code, language = 'auto', focus = 'general') {
+export async function improveCode(code, language = 'auto', focus = 'general', mode = 'full') {
   try {
     const response = await apiClient.post('/improve', {
       code,
       language,
       focus,
+      mode,
     });
     return response;
   } catch (error) {